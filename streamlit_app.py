@@ -161,7 +161,8 @@ if 'tableau_token' in st.session_state:
                     sec_old = tc.extract_sections(root_old)
                     sec_new = tc.extract_sections(root_new)
                     
-                    # 3. Reset Registry
+                    # 3. Reset Registry (and semantic memos from earlier runs)
+                    tc.reset_comparison_caches()
                     tc.CHANGE_REGISTRY = {
                         "workbook": [], "datasources": {}, "calculations": {}, 
                         "parameters": {}, "worksheets": {}, "dashboards": {}, "stories": {}
@@ -203,11 +204,10 @@ if 'tableau_token' in st.session_state:
                         tc.build_workbook_kpi_snapshot(sec_new)
                     )
                     visual_tree = tc.render_visual_change_tree(sec_new, tc.CHANGE_REGISTRY, tgt_wb)
-                    perm_html = (
-                        tc.build_users_permissions_card_with_context(src_proj, src_wb, src_perms, "source")
-                        + "<hr/>" +
-                        tc.build_users_permissions_card_with_context(tgt_proj, tgt_wb, tgt_perms, "Target")
-                    )
+                    perm_html = "<hr/>".join((
+                        tc.build_users_permissions_card_with_context(src_proj, src_wb, src_perms, "source"),
+                        tc.build_users_permissions_card_with_context(tgt_proj, tgt_wb, tgt_perms, "Target"),
+                    ))
 
                     # 10. Generate Report
                     tc.generate_html_report(
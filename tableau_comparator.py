@@ -16,10 +16,18 @@ Changes vs v3.1:
   • Deep XML heuristics for control types, actions, legends, stories/story points.
 
 """
-import os, re, html, zipfile, tempfile, webbrowser, requests, urllib3, pathlib, httpx, io
+import os, re, html, gzip, hashlib, zipfile, tempfile, webbrowser, requests, urllib3, pathlib, httpx, io, threading, time
 import xml.etree.ElementTree as ET
 from datetime import datetime
+from http.cookiejar import DefaultCookiePolicy
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import chain
+from sys import intern
 from xmldiff.main import diff_texts
+from xmldiff.diff import Differ
+from xmldiff.actions import InsertNamespace, DeleteNamespace
 from xmldiff.formatting import DiffFormatter
 from openai import OpenAI
 from lxml import etree
@@ -32,6 +40,14 @@ from lxml import etree
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 VERIFY_SSL = False
 
+# one pooled session for every Tableau REST call, so the thread pools in
+# main() reuse keep-alive connections instead of a TCP+TLS handshake each.
+# Auth travels in X-Tableau-Auth, and the session is shared by every
+# Streamlit user, so no response cookie is ever stored in its jar.
+_HTTP = requests.Session()
+_HTTP.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+_HTTP.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
 # ----------- CONFIG: Tableau Online (replace with your values) -----------
 TABLEAU_SITE_URL = os.environ.get("TABLEAU_SITE_URL")
 SITE_ID_CONTENT_URL = os.environ.get("TABLEAU_SITE_ID")
@@ -61,10 +77,10 @@ def sign_in(server_url, site_id_content, token_name, token_secret):
     }}
     
     # We use verify=False because the original script had VERIFY_SSL = False
-    r = requests.post(url, json=payload, verify=False, timeout=60)
+    r = _HTTP.post(url, json=payload, verify=False, timeout=60)
     r.raise_for_status()
     
-    root = ET.fromstring(r.text)
+    root = ET.fromstring(r.content)
     ns = {"t":"http://tableau.com/api"}
     
     token = root.find(".//t:credentials", ns).attrib["token"]
@@ -118,12 +134,12 @@ def build_users_permissions_card_with_context(
         ">
             <div>
                 <strong>{context_label} Project:</strong>
-                <span style="opacity:0.85;">{project_name}</span>
+                <span style="opacity:0.85;">{str(project_name).translate(_HTML_ESCAPE_TABLE)}</span>
             </div>
 
             <div>
                 <strong>{context_label} Workbook:</strong>
-                <span style="opacity:0.85;">{workbook_name}</span>
+                <span style="opacity:0.85;">{str(workbook_name).translate(_HTML_ESCAPE_TABLE)}</span>
             </div>
         </div>
 
@@ -153,7 +169,7 @@ def get_workbook_id_in_project(token, site_id, project_name, workbook_name):
             f"?pageNumber={page_number}&pageSize={page_size}"
         )
 
-        r = requests.get(
+        r = _HTTP.get(
             url,
             headers={"X-Tableau-Auth": token},
             verify=VERIFY_SSL,
@@ -161,7 +177,7 @@ def get_workbook_id_in_project(token, site_id, project_name, workbook_name):
         )
         r.raise_for_status()
 
-        root = ET.fromstring(r.text)
+        root = ET.fromstring(r.content)
 
         pagination = root.find(".//t:pagination", ns)
         total_available = int(pagination.attrib.get("totalAvailable", "0"))
@@ -200,7 +216,7 @@ def get_workbook_id_in_project(token, site_id, project_name, workbook_name):
 
 def get_workbook_owner(token, site_id, wid):
     url = f"{TABLEAU_SITE_URL}/api/3.25/sites/{site_id}/workbooks/{wid}"
-    r = requests.get(
+    r = _HTTP.get(
         url,
         headers={"X-Tableau-Auth": token},
         verify=VERIFY_SSL,
@@ -209,7 +225,7 @@ def get_workbook_owner(token, site_id, wid):
     if r.status_code != 200:
         return None
 
-    root = ET.fromstring(r.text)
+    root = ET.fromstring(r.content)
     ns = {"t": "http://tableau.com/api"}
 
     owner = root.find(".//t:owner", ns)
@@ -217,11 +233,11 @@ def get_workbook_owner(token, site_id, wid):
 
 def get_revisions(token, site_id, wid):
     url = f"{TABLEAU_SITE_URL}/api/3.25/sites/{site_id}/workbooks/{wid}/revisions"
-    r = requests.get(url, headers={"X-Tableau-Auth": token}, verify=VERIFY_SSL, timeout=60)
+    r = _HTTP.get(url, headers={"X-Tableau-Auth": token}, verify=VERIFY_SSL, timeout=60)
     if r.status_code != 200:
         return []
 
-    root = ET.fromstring(r.text)
+    root = ET.fromstring(r.content)
     ns = {"t": "http://tableau.com/api"}
     revs = []
 
@@ -253,33 +269,88 @@ def get_latest_revision_number(token, site_id, workbook_id):
     return latest["number"], latest
 
 
+# permission responses are parsed with lxml; these queries are compiled once
+_TS_NS = {"t": "http://tableau.com/api"}
+_XP_GRANTEES = etree.XPath(".//t:granteeCapabilities", namespaces=_TS_NS)
+_XP_CAPABILITIES = etree.XPath("t:capabilities/t:capability", namespaces=_TS_NS)
+
 def get_project_permissions(token, site_id, project_id):
     url = f"{TABLEAU_SITE_URL}/api/3.21/sites/{site_id}/projects/{project_id}/permissions"
-    r = requests.get(
+    r = _HTTP.get(
         url,
         headers={"X-Tableau-Auth": token},
         verify=VERIFY_SSL,
         timeout=30
     )
     r.raise_for_status()
-    return ET.fromstring(r.text)
+    return etree.fromstring(r.content)
 
 def get_workbook_permissions(token, site_id, workbook_id):
     url = f"{TABLEAU_SITE_URL}/api/3.21/sites/{site_id}/workbooks/{workbook_id}/permissions"
-    r = requests.get(
+    r = _HTTP.get(
         url,
         headers={"X-Tableau-Auth": token},
         verify=VERIFY_SSL,
         timeout=30
     )
     r.raise_for_status()
-    return ET.fromstring(r.text)
+    return etree.fromstring(r.content)
+
+# (token digest, site_id, project, workbook) -> (fetched_at, rows), kept as
+# an LRU of at most _PERMISSIONS_MAXSIZE entries. Fresh entries skip the REST
+# calls; a copy younger than _PERMISSIONS_STALE_MAX is served only if a later
+# fetch fails on the connection or a 5xx. 4xx errors always reach the caller.
+_PERMISSIONS_TTL = 30
+_PERMISSIONS_STALE_MAX = 600
+_PERMISSIONS_MAXSIZE = 256
+_permissions_cache = OrderedDict()
+_permissions_lock = threading.Lock()
 
 def get_users_and_permissions_for_workbook(
     token,
     site_id,
     project_name,
     workbook_name
+):
+    token_digest = hashlib.sha256(str(token).encode("utf-8")).hexdigest()
+    key = (token_digest, site_id, project_name, workbook_name)
+    now = time.monotonic()
+    with _permissions_lock:
+        hit = _permissions_cache.get(key)
+        if hit is not None:
+            if now - hit[0] < _PERMISSIONS_TTL:
+                _permissions_cache.move_to_end(key)
+                return hit[1]
+            if now - hit[0] >= _PERMISSIONS_STALE_MAX:
+                del _permissions_cache[key]
+                hit = None
+
+    try:
+        rows = _fetch_users_and_permissions_for_workbook(
+            token, site_id, project_name, workbook_name
+        )
+    except requests.HTTPError as e:
+        status = e.response.status_code if e.response is not None else 0
+        if hit is not None and status >= 500:
+            return hit[1]   # stale but last known good
+        raise
+    except (requests.ConnectionError, requests.Timeout):
+        if hit is not None:
+            return hit[1]
+        raise
+
+    with _permissions_lock:
+        _permissions_cache[key] = (time.monotonic(), rows)
+        _permissions_cache.move_to_end(key)
+        while len(_permissions_cache) > _PERMISSIONS_MAXSIZE:
+            _permissions_cache.popitem(last=False)
+    return rows
+
+def _fetch_users_and_permissions_for_workbook(
+    token,
+    site_id,
+    project_name,
+    workbook_name
 ):
     workbook_id, project_id = get_workbook_id_in_project(
         token, site_id, project_name, workbook_name
@@ -341,7 +412,7 @@ def parse_effective_workbook_permissions(
             return None
 
         url = f"{TABLEAU_SITE_URL}/api/3.21/sites/{site_id}/users/{user_id}"
-        r = requests.get(
+        r = _HTTP.get(
             url,
             headers={"X-Tableau-Auth": token},
             verify=VERIFY_SSL,
@@ -351,7 +422,7 @@ def parse_effective_workbook_permissions(
         if r.status_code != 200:
             return None
 
-        u = ET.fromstring(r.text).find(".//t:user", ns)
+        u = ET.fromstring(r.content).find(".//t:user", ns)
         if u is None:
             return None
 
@@ -372,7 +443,7 @@ def parse_effective_workbook_permissions(
             return None
 
         url = f"{TABLEAU_SITE_URL}/api/3.21/sites/{site_id}/groups/{group_id}"
-        r = requests.get(
+        r = _HTTP.get(
             url,
             headers={"X-Tableau-Auth": token},
             verify=VERIFY_SSL,
@@ -382,7 +453,7 @@ def parse_effective_workbook_permissions(
         if r.status_code != 200:
             return None
 
-        g = ET.fromstring(r.text).find(".//t:group", ns)
+        g = ET.fromstring(r.content).find(".//t:group", ns)
         return g.attrib.get("name") if g is not None else None
 
     # ---------------- PERMISSION EXTRACTION ----------------
@@ -392,7 +463,7 @@ def parse_effective_workbook_permissions(
         if root is None:
             return data
 
-        for gc in root.findall(".//t:granteeCapabilities", ns):
+        for gc in _XP_GRANTEES(root):
 
             user = gc.find("t:user", ns)
             group = gc.find("t:group", ns)
@@ -428,7 +499,7 @@ def parse_effective_workbook_permissions(
                 name = "All Users" if gtype == "Group" else "Unknown"
 
             allow, deny = set(), set()
-            for cap in gc.findall("t:capabilities/t:capability", ns):
+            for cap in _XP_CAPABILITIES(gc):
                 mode = cap.attrib.get("mode")
                 cname = cap.attrib.get("name")
                 if mode == "Allow":
@@ -492,7 +563,7 @@ def resolve_user_name(server, api_version, token, site_id, user_id):
     url = f"{server}/api/{api_version}/sites/{site_id}/users/{user_id}"
     headers = {"X-Tableau-Auth": token}
 
-    r = requests.get(url, headers=headers)
+    r = _HTTP.get(url, headers=headers)
     if r.status_code != 200:
         return None
 
@@ -627,7 +698,7 @@ def download_rev(token, site_id, wid, rev, force=False):
             f"{TABLEAU_SITE_URL}/api/3.25/sites/{site_id}/workbooks/{wid}/revisions/{rev}/content"
         )
 
-    r = requests.get(
+    r = _HTTP.get(
         url,
         headers={"X-Tableau-Auth": token},
         verify=VERIFY_SSL,
@@ -642,7 +713,7 @@ def download_rev(token, site_id, wid, rev, force=False):
         url = (
             f"{TABLEAU_SITE_URL}/api/3.25/sites/{site_id}/workbooks/{wid}/content"
         )
-        r = requests.get(
+        r = _HTTP.get(
             url,
             headers={"X-Tableau-Auth": token},
             verify=VERIFY_SSL,
@@ -703,7 +774,10 @@ def download_latest_workbook_revision(
 
 
 def parse_twb(path):
+    """Parse a TWB from a file path, or from its already-read bytes."""
     try:
+        if isinstance(path, bytes):
+            return ET.fromstring(path)
         return ET.parse(path).getroot()
     except Exception:
         return None
@@ -722,6 +796,7 @@ CHANGE_REGISTRY = {
 
 
 
+@lru_cache(maxsize=4096)
 def simplify_visual_bullet(b):
     if "Datasource filter added" in b:
         return "Datasource filter added"
@@ -877,24 +952,142 @@ def xmldiff_text(a_xml, b_xml):
     except Exception as e:
         return f"(xmldiff failed: {e})"
 
+# matches the parser diff_texts builds for DiffFormatter (blank text dropped)
+_DIFF_PARSER = etree.XMLParser(remove_blank_text=True, huge_tree=True)
+
+def _iter_diff_actions(left, right, abs_path=None):
+    """
+    Formatted edits between two elements. With abs_path set, left/right are
+    units below the document root: Differ deepcopies them into trees of
+    their own, so namespace edits from the lost inherited nsmap are dropped
+    and every xpath is re-rooted at abs_path.
+    """
+    formatter = DiffFormatter()
+    formatter.prepare(left, right)
+    rel_root = "/" + left.tag
+    for action in Differ().diff(left, right):
+        if abs_path is not None:
+            if isinstance(action, (InsertNamespace, DeleteNamespace)):
+                continue
+            action = action._replace(**{
+                f: abs_path + getattr(action, f)[len(rel_root):]
+                for f in ("node", "target")
+                if f in action._fields
+                and (getattr(action, f) == rel_root
+                     or getattr(action, f).startswith(rel_root + "/"))
+            })
+        # DiffFormatter.format wraps each action in brackets the same way
+        yield f"[{formatter.handle_action(action)}]"
+
+# <workbook> children whose own children are diffed one by one
+_DIFF_CONTAINERS = frozenset(("datasources", "worksheets", "dashboards"))
+
+def _diff_units(root):
+    """
+    Elements compared independently by iter_xmldiff_bytes, keyed by
+    (container, tag, name, occurrence). Datasources, worksheets and
+    dashboards are unpacked so each one is its own unit; every other
+    top-level child is a single unit. Also returns the attributes of each
+    unpacked container so a change there forces the full diff. Returns
+    (None, None) when a unit is not a plain un-namespaced element.
+    """
+    units, seen, shells = {}, {}, []
+    for child in root:
+        if not isinstance(child.tag, str):
+            return None, None
+        if child.tag in _DIFF_CONTAINERS:
+            shells.append((child.tag, dict(child.attrib)))
+            members = [(child.tag, el) for el in child]
+        else:
+            members = [(None, child)]
+        for container, el in members:
+            if not isinstance(el.tag, str) or el.tag.startswith("{"):
+                return None, None
+            base = (container, el.tag, el.get("name"))
+            n = seen.get(base, 0)
+            seen[base] = n + 1
+            units[(*base, n)] = el
+    return units, shells
+
+def iter_xmldiff_bytes(a_xml: bytes, b_xml: bytes):
+    """
+    xmldiff_text for raw XML bytes, one formatted edit line at a time.
+    Bytes are parsed straight into lxml (no unicode round trip) and edits
+    are formatted as the Differ yields them, so no full diff string is built.
+
+    xmldiff is quadratic, so when both workbooks have the same set of
+    units (see _diff_units), only the units whose serialized bytes differ
+    are diffed, one at a time, with their xpaths rewritten to the
+    unit's absolute path (edits come out grouped by unit). Anything else
+    falls back to one full-tree diff.
+    """
+    if not a_xml or not b_xml or a_xml == b_xml: return
+    try:
+        left = etree.fromstring(a_xml, _DIFF_PARSER)
+        right = etree.fromstring(b_xml, _DIFF_PARSER)
+        old_units, old_shells = _diff_units(left)
+        new_units, new_shells = _diff_units(right)
+        if (old_units is None or new_units is None
+                or left.attrib != right.attrib or left.nsmap != right.nsmap
+                or old_shells != new_shells
+                or list(old_units) != list(new_units)):
+            yield from _iter_diff_actions(left, right)
+            return
+        tree = left.getroottree()
+        for key, o in old_units.items():
+            n = new_units[key]
+            if etree.tostring(o) == etree.tostring(n):
+                continue
+            yield from _iter_diff_actions(o, n, tree.getpath(o))
+    except Exception as e:
+        yield f"(xmldiff failed: {e})"
+
+# Shared fragment parser. Comments/PIs are dropped so every node has a str tag.
+_PARSER = etree.XMLParser(
+    huge_tree=True,
+    remove_blank_text=True,
+    remove_comments=True,
+    remove_pis=True,
+    collect_ids=False,
+    resolve_entities=False,
+)
+# same settings, but keeps whatever it can from damaged markup instead of raising
+_RECOVER_PARSER = etree.XMLParser(
+    recover=True,
+    huge_tree=True,
+    remove_blank_text=True,
+    remove_comments=True,
+    remove_pis=True,
+    collect_ids=False,
+    resolve_entities=False,
+)
+_XMLNS_RE = re.compile(rb'\sxmlns(:\w+)?="[^"]+"')
+_NS_TAG_RE = re.compile(rb"<(/?)[A-Za-z0-9_]+:([A-Za-z0-9_-]+)")
+_NS_ATTR_RE = re.compile(rb"([ \t\n])([A-Za-z0-9_]+):([A-Za-z0-9_-]+)=")
+
 def _parse_fragment(x):
     if x is None: return None
-    if isinstance(x, (bytes, bytearray)): x = x.decode("utf-8","ignore")
-    if isinstance(x, ET.Element): return x
-    cleaned = re.sub(r'\sxmlns(:\w+)?="[^"]+"',"", x)
-    cleaned = re.sub(r"<(/?)[A-Za-z0-9_]+:([A-Za-z0-9_-]+)", r"<\1\2", cleaned)
-    cleaned = re.sub(r"([ \t\n])([A-Za-z0-9_]+):([A-Za-z0-9_-]+)=", r"\1\3=", cleaned)
+    if isinstance(x, etree._Element): return x
+    if isinstance(x, ET.Element): x = ET.tostring(x)
+    elif isinstance(x, str): x = x.encode("utf-8")
+    cleaned = _XMLNS_RE.sub(b"", x)
+    cleaned = _NS_TAG_RE.sub(rb"<\1\2", cleaned)
+    cleaned = _NS_ATTR_RE.sub(rb"\1\3=", cleaned)
     try:
-        return ET.fromstring(cleaned)
-    except ET.ParseError:
-        try:
-            return ET.fromstring(f"<_root_>{cleaned}</_root_>")
-        except ET.ParseError:
-            return None
+        return etree.fromstring(cleaned, _PARSER)
+    except etree.XMLSyntaxError:
+        # multi-root or damaged fragment: wrap it and recover what parses
+        root = etree.fromstring(b"<_root_>" + cleaned + b"</_root_>", _RECOVER_PARSER)
+        if root is not None:
+            # recovery keeps undefined entities as Entity nodes (non-str tag)
+            etree.strip_elements(root, etree.Entity, with_tail=False)
+        return root
+
+_STRIP_BRACKETS = str.maketrans("", "", "[]")
 
 def _add_field(s, v):
     if not v: return
-    f=v.strip().replace("[","").replace("]","")
+    f=v.strip().translate(_STRIP_BRACKETS)
     if "." in f: f=f.split(".")[-1]
     if f: s.add(f)
 
@@ -911,6 +1104,8 @@ def extract_sections(root):
         return out
 
     for e in root.iter():
+        if not isinstance(e.tag, str):
+            continue
         tag = e.tag.lower().split("}")[-1]
         if tag == "dashboard":
             name = e.attrib.get("name", "unnamed")
@@ -927,8 +1122,8 @@ def extract_sections(root):
         elif tag == "story":
             out["stories"][e.attrib.get("name","Story")] = ET.tostring(e, encoding="unicode")
         elif tag == "datasource":
-            nm = resolve_datasource_name(ET.tostring(e, encoding="unicode"))
-            out["datasources"][nm] = ET.tostring(e, encoding="unicode")
+            ds_xml = ET.tostring(e, encoding="unicode")
+            out["datasources"][resolve_datasource_name(ds_xml)] = ds_xml
         elif tag == "column":
             name = (
                 e.attrib.get("caption")
@@ -955,7 +1150,24 @@ def extract_sections(root):
     return out
 
 
+# fragment digest -> collect_semantics result; the same worksheet and
+# dashboard strings are scanned by the delta, card and tree passes.
+# Keyed on a digest so the XML strings themselves are not kept alive.
+_semantics_memo = {}
+
 def collect_semantics(xml_text:str)->dict:
+    """Deep semantic features (memoised for str input; treat as read-only)."""
+    if not isinstance(xml_text, str):
+        return _collect_semantics(xml_text)
+    key = hashlib.blake2b(xml_text.encode("utf-8"), digest_size=16).digest()
+    hit = _semantics_memo.get(key)
+    if hit is None:
+        if len(_semantics_memo) >= 512:
+            _semantics_memo.clear()
+        hit = _semantics_memo[key] = _collect_semantics(xml_text)
+    return hit
+
+def _collect_semantics(xml_text)->dict:
     """Deep semantic features for dashboards/worksheets/stories."""
     feats={"filters":set(),"date_filters":set(),"filter_controls":set(),
            "colors":set(),"tooltip_fields":set(),"tooltip_raw":"",
@@ -963,12 +1175,13 @@ def collect_semantics(xml_text:str)->dict:
            "mark_shape_by":set(),"mark_label_by":set(),
            "dashboard_sheets":set(),"dashboard_size":"",
            "dashboard_filters":set(),"legends":set(),
-           "actions":set()}
+           "actions":set(),"context_filters":set()}
     root=_parse_fragment(xml_text)
     if root is None: return feats
 
+    # _parse_fragment strips namespaces, so el.tag is already the local name
     def is_noise(el):
-        return el.tag.lower().split("}")[-1] in NOISE_TAGS
+        return el.tag in NOISE_TAGS
 
     CONTROL_HINTS = [
         ("single value", "Single Value"),
@@ -1008,7 +1221,7 @@ def collect_semantics(xml_text:str)->dict:
 
     for el in root.iter():
         # ADD after existing for el in root.iter():
-        tag = el.tag.lower().split("}")[-1]
+        tag = el.tag
 
         # --- Dashboard Filter Zones ---
         if tag in ("filter-item", "dashboard-item"):
@@ -1058,6 +1271,9 @@ def collect_semantics(xml_text:str)->dict:
             if f:
                 _add_field(feats["filters"], f)
                 if "date" in f.lower(): _add_field(feats["date_filters"], f)
+            if tag=="filter" and el.attrib.get("context")=="true":
+                cf = el.attrib.get("column") or el.attrib.get("field")
+                if cf: feats["context_filters"].add(cf.translate(_STRIP_BRACKETS))
             hint_candidates = list(el.attrib.values())
             for sub in el.iter():
                 for v in sub.attrib.values():
@@ -1084,7 +1300,7 @@ def collect_semantics(xml_text:str)->dict:
                       "action")
             scope = "workbook"
             for cc in el.iter():
-                ctag = cc.tag.lower().split("}")[-1]
+                ctag = cc.tag
                 if ctag == "source":
                     if "dashboard" in cc.attrib:
                         scope = f"dashboard:{cc.attrib.get('dashboard')}"
@@ -1094,7 +1310,7 @@ def collect_semantics(xml_text:str)->dict:
             feats["actions"].add(f"{a_type} — {cap} ({scope})")
             # capture fields involved
             for cc in el.iter():
-                ctag = cc.tag.lower().split("}")[-1]
+                ctag = cc.tag
                 if ctag in ("source-column","target-column","column","field","filter"):
                     f=cc.attrib.get("name") or cc.attrib.get("field") or cc.attrib.get("column")
                     if f: _add_field(feats["dashboard_filters"], f)
@@ -1111,7 +1327,7 @@ def collect_semantics(xml_text:str)->dict:
         if tag in ("encodings","encoding"):
             nodes = el if tag=="encodings" else [el]
             for enc in nodes:
-                e_tag = enc.tag.lower().split("}")[-1]
+                e_tag = enc.tag
                 fld = enc.attrib.get("field") or enc.attrib.get("column") or enc.attrib.get("name")
                 if fld:
                     _add_field(feats["mark_fields"], fld)
@@ -1123,11 +1339,10 @@ def collect_semantics(xml_text:str)->dict:
 
         # tooltip
         if tag=="tooltip":
-            feats["tooltip_raw"] = ET.tostring(el, encoding="unicode")
-            for run in el.iter():
-                if run.tag.lower().split("}")[-1]=="run":
-                    txt="".join(run.itertext()).strip()
-                    if txt: _add_field(feats["tooltip_fields"], txt)
+            feats["tooltip_raw"] = etree.tostring(el, encoding="unicode")
+            for run in el.iter("run"):
+                txt="".join(run.itertext()).strip()
+                if txt: _add_field(feats["tooltip_fields"], txt)
 
         # color hints
         for k,v in el.attrib.items():
@@ -1170,7 +1385,7 @@ def collect_semantics(xml_text:str)->dict:
 
     for k in ["filters","date_filters","filter_controls","colors","tooltip_fields",
               "mark_fields","mark_color_by","mark_size_by","mark_shape_by","mark_label_by",
-              "dashboard_sheets","dashboard_filters","legends","actions"]:
+              "dashboard_sheets","dashboard_filters","legends","actions","context_filters"]:
         feats[k] = sorted(feats[k])
     return feats
 
@@ -1464,21 +1679,41 @@ def has_repository_location(root) -> bool:
 
 
 
+_DATASOURCE_BLOCK_RE = re.compile(
+    r'(<datasource [^>]*>.*?</datasource>)',
+    re.DOTALL | re.IGNORECASE
+)
+_DATASOURCE_NAME_RE = re.compile(r'(?:caption|name)=[\'"]([^\'"]+)[\'"]')
+
 def extract_datasources_raw(file_path):
     if not file_path or not os.path.exists(file_path):
         return {}
 
-    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-        content = f.read()
+    # keyed on the file's mtime/size, so a re-downloaded TWB misses the cache
+    st = os.stat(file_path)
+    return dict(_extract_datasources_cached(file_path, st.st_mtime_ns, st.st_size))
 
-    datasources = {}
-    pattern = re.compile(
-        r'(<datasource [^>]*>.*?</datasource>)',
-        re.DOTALL | re.IGNORECASE
+@lru_cache(maxsize=16)
+def _extract_datasources_cached(file_path, mtime_ns, size):
+    return extract_datasources_from_text(
+        decode_twb_bytes(pathlib.Path(file_path).read_bytes())
     )
 
-    for i, xml in enumerate(pattern.findall(content)):
-        name_match = re.search(r'(?:caption|name)=[\'"]([^\'"]+)[\'"]', xml)
+def decode_twb_bytes(raw: bytes) -> str:
+    """
+    TWB bytes -> text exactly as a text-mode read gives it (UTF-8, bad bytes
+    dropped, universal newlines), so the CLI and Streamlit paths agree.
+    """
+    return raw.decode("utf-8", errors="ignore").replace("\r\n", "\n").replace("\r", "\n")
+
+def extract_datasources_from_text(content):
+    """
+    extract_datasources_raw for TWB text that is already in memory.
+    """
+    datasources = {}
+
+    for i, xml in enumerate(_DATASOURCE_BLOCK_RE.findall(content)):
+        name_match = _DATASOURCE_NAME_RE.search(xml)
         name = name_match.group(1) if name_match else f"Datasource_{i}"
         datasources[name] = xml
 
@@ -1617,9 +1852,9 @@ def resolve_luid_by_content_url(name, site_id, token):
     params = {"filter": f"contentUrl:eq:{name}"}
     headers = {"X-Tableau-Auth": token}
     try:
-        r = requests.get(url, headers=headers, params=params, verify=False)
+        r = _HTTP.get(url, headers=headers, params=params, verify=False)
         if r.status_code == 200:
-            root = ET.fromstring(r.text)
+            root = ET.fromstring(r.content)
             ds = root.find(".//datasource")
             if ds is not None: return ds.get("id") 
     except: pass
@@ -1644,35 +1879,41 @@ def download_published_xml(xml_chunk, site_id, token):
     def attempt_download(target_id):
         url = f"{TABLEAU_SITE_URL}/api/3.25/sites/{site_id}/datasources/{target_id}/content"
         headers = {"X-Tableau-Auth": token}
-        return requests.get(url, headers=headers, stream=True, verify=False)
+        return _HTTP.get(url, headers=headers, stream=True, verify=False)
 
     # 1. Attempt with ID
     r = attempt_download(ds_id or ds_name)
 
-    # 2. If 404, try resolve (Silently)
-    if r.status_code == 404:
-        name_to_resolve = ds_name if ds_name else ds_id
-        resolved_luid = resolve_luid_by_content_url(name_to_resolve, site_id, token)
-        if resolved_luid:
-            r = attempt_download(resolved_luid)
-        else:
-            # Silent fail
-            return None
+    # streamed responses hold a pooled connection until closed, so every
+    # exit below (including the early ones) releases them
+    try:
+        # 2. If 404, try resolve (Silently)
+        if r.status_code == 404:
+            r.close()
+            name_to_resolve = ds_name if ds_name else ds_id
+            resolved_luid = resolve_luid_by_content_url(name_to_resolve, site_id, token)
+            if resolved_luid:
+                r = attempt_download(resolved_luid)
+            else:
+                # Silent fail
+                return None
 
-    if r.status_code != 200: return None
+        if r.status_code != 200: return None
 
-    # 3. Extract Content
-    try:
-        if r.content[:4] == b'PK\x03\x04':
-            with zipfile.ZipFile(io.BytesIO(r.content)) as z:
-                for filename in z.namelist():
-                    if filename.endswith(".tds"):
-                        with z.open(filename) as f:
-                            return f.read().decode("utf-8", errors="ignore")
-        else:
-            return r.text
-    except:
-        return None
+        # 3. Extract Content
+        try:
+            if r.content[:4] == b'PK\x03\x04':
+                with zipfile.ZipFile(io.BytesIO(r.content)) as z:
+                    for filename in z.namelist():
+                        if filename.endswith(".tds"):
+                            with z.open(filename) as f:
+                                return f.read().decode("utf-8", errors="ignore")
+            else:
+                return r.text
+        except:
+            return None
+    finally:
+        r.close()
 
 
 def get_connection_class(xml_text):
@@ -1756,6 +1997,8 @@ def get_connection_class(xml_text):
 
     return "Unknown"
 
+_REGISTRY_LOCK = threading.Lock()
+
 def compare(name, old_xml, new_xml, site_id, token):
 
     # PRE-ANALYSIS
@@ -1857,13 +2100,14 @@ def compare(name, old_xml, new_xml, site_id, token):
 
     bullets.insert(0, summary)
 
-    # SAVE
-    CHANGE_REGISTRY["datasources"].setdefault(name, []).append({
-        "status": "modified" if old_info != new_info else "info",
-        "title": "Datasource Metadata & Connection",
-        "object": "__metadata__",
-        "bullets": bullets
-    })
+    # SAVE (compare may run on several threads, see main)
+    with _REGISTRY_LOCK:
+        CHANGE_REGISTRY["datasources"].setdefault(name, []).append({
+            "status": "modified" if old_info != new_info else "info",
+            "title": "Datasource Metadata & Connection",
+            "object": "__metadata__",
+            "bullets": bullets
+        })
 
 
 def summarize_datasources(ds_name, old_xml, new_xml):
@@ -2112,17 +2356,13 @@ def build_workbook_kpi_snapshot(sections: dict) -> dict:
     # ==================================================
     # FILTERS
     # ==================================================
-    sem = collect_workbook_semantics(sections)
+    sem = _sem(sections)
 
+    # collect_semantics is memoised, so the visual change tree reuses
+    # these worksheet walks instead of parsing each worksheet again
     context_filters = set()
     for ws_xml in sections.get("worksheets", {}).values():
-        root = _parse_fragment(ws_xml)
-        if root is None:
-            continue
-        for f in root.findall(".//filter[@context='true']"):
-            name = f.attrib.get("column") or f.attrib.get("field")
-            if name:
-                context_filters.add(name.replace("[", "").replace("]", ""))
+        context_filters.update(collect_semantics(ws_xml)["context_filters"])
 
     ds_filters = set()
     for ds_xml in sections.get("datasources", {}).values():
@@ -2617,6 +2857,8 @@ def summarize_global_actions(old_root, new_root):
 
         actions_nodes = []
         for elem in root.iter():
+            if not isinstance(elem.tag, str):
+                continue
             tag = elem.tag.lower().split("}")[-1]
             if tag == "actions":
                 actions_nodes.append(elem)
@@ -2627,6 +2869,8 @@ def summarize_global_actions(old_root, new_root):
         result = {}
         for actions_node in actions_nodes:
             for action in actions_node:
+                if not isinstance(action.tag, str):
+                    continue
                 a_tag = action.tag.lower().split("}")[-1]
                 if a_tag != "action":
                     continue
@@ -2656,6 +2900,8 @@ def summarize_global_actions(old_root, new_root):
                 # Detect scope
                 scope = "unknown"
                 for child in action:
+                    if not isinstance(child.tag, str):
+                        continue
                     ctag = child.tag.lower().split("}")[-1]
                     if ctag == "source":
                         if "dashboard" in child.attrib:
@@ -2733,13 +2979,15 @@ def summarize_global_actions(old_root, new_root):
 
 def _parse_action_details(action_elem):
     """
-    Parse an <action> element (ElementTree Element) and return a dict:
+    Parse an <action> element and return a dict:
       - caption, type, scope
-      - sources: list of {"dashboard"/"worksheet","name"}
-      - targets: list of {"dashboard"/"worksheet","name"}
-      - field_mappings: list of {"field","role"} 
+      - sources: list of (kind, name) tuples, kind is "dashboard"/"worksheet"
+      - targets: list of (kind, name) tuples
+      - field_mappings: list of (field, role) tuples
       - behavior: textual hint (Replace / Add / Keep / Exclude / unknown)
       - raw_xml: str
+
+    Expects an lxml element.
     """
     details = {
         "caption": None,
@@ -2749,7 +2997,7 @@ def _parse_action_details(action_elem):
         "targets": [],
         "field_mappings": [],
         "behavior": "unknown",
-        "raw_xml": ET.tostring(action_elem, encoding="unicode")
+        "raw_xml": etree.tostring(action_elem, encoding="unicode")
     }
 
     # caption
@@ -2771,29 +3019,28 @@ def _parse_action_details(action_elem):
 
     # iterate children for source/target/columns/behaviour
     for child in action_elem.iter():
+        if not isinstance(child.tag, str):
+            continue
         ctag = child.tag.lower().split("}")[-1]
         # Source / Target node detection
         if ctag == "source":
             # dashboard or worksheet attribute
             if "dashboard" in child.attrib:
-                details["sources"].append({"kind": "dashboard", "name": child.attrib.get("dashboard")})
+                details["sources"].append(("dashboard", child.attrib.get("dashboard")))
             elif "worksheet" in child.attrib:
-                details["sources"].append({"kind": "worksheet", "name": child.attrib.get("worksheet")})
+                details["sources"].append(("worksheet", child.attrib.get("worksheet")))
         if ctag == "target":
             if "dashboard" in child.attrib:
-                details["targets"].append({"kind": "dashboard", "name": child.attrib.get("dashboard")})
+                details["targets"].append(("dashboard", child.attrib.get("dashboard")))
             elif "worksheet" in child.attrib:
-                details["targets"].append({"kind": "worksheet", "name": child.attrib.get("worksheet")})
+                details["targets"].append(("worksheet", child.attrib.get("worksheet")))
 
         # Field/column mapping
         if ctag in ("source-column", "target-column", "column", "field", "filter"):
             src_field = child.attrib.get("name") or child.attrib.get("field") or child.attrib.get("column")
             role = ctag
             if src_field:
-                details["field_mappings"].append({
-                    "field": src_field,
-                    "role": role
-                })
+                details["field_mappings"].append((src_field, role))
 
         # Behavior hints
         for k, v in child.attrib.items():
@@ -2917,12 +3164,10 @@ def extract_dashboard_worksheets(xml):
     if root is None:
         return sheets
 
-    for el in root.iter():
-        tag = el.tag.lower().split("}")[-1]
-        if tag in ("zone", "worksheet", "sheet"):
-            nm = el.attrib.get("name") or el.attrib.get("sheet")
-            if nm:
-                sheets.add(nm)
+    for el in root.iter("zone", "worksheet", "sheet"):
+        nm = el.attrib.get("name") or el.attrib.get("sheet")
+        if nm:
+            sheets.add(intern(nm))
     return sheets
 
 def extract_story_contents(xml):
@@ -2953,15 +3198,15 @@ def extract_worksheet_fields(xml):
     if root is None:
         return fields
 
-    for el in root.iter():
-        tag = el.tag.lower().split("}")[-1]
-        if tag in ("column", "field", "encoding"):
-            f = el.attrib.get("name") or el.attrib.get("field") or el.attrib.get("column")
-            if f:
-                f = f.replace("[", "").replace("]", "")
-                fields.add(f)
+    for el in root.iter("column", "field", "encoding"):
+        f = el.attrib.get("name") or el.attrib.get("field") or el.attrib.get("column")
+        if f:
+            f = f.replace("[", "").replace("]", "")
+            fields.add(intern(f))
     return fields
 
+_WS_RE = re.compile(r"\s+")
+
 def parse_joins(xml):
     root = _parse_fragment(xml)
     joins = []
@@ -2972,7 +3217,8 @@ def parse_joins(xml):
         jtype = rel.attrib.get("join", "unknown")
         clauses = []
         for c in rel.findall(".//clause"):
-            txt = " ".join("".join(e.itertext()).strip() for e in c.iter())
+            # single text pass over the clause subtree
+            txt = _WS_RE.sub(" ", " ".join(c.itertext())).strip()
             if txt:
                 clauses.append(txt)
         if clauses:
@@ -2990,12 +3236,17 @@ def parse_relationships(xml):
         for c in r.findall(".//relationship-column"):
             col = c.attrib.get("column")
             if col:
-                cols.append(col.replace("[","").replace("]",""))
+                cols.append(intern(col.replace("[","").replace("]","")))
         if cols:
             rels.add("Relationship on " + ", ".join(cols))
     return rels
 
 
+def _maybe_unescape(s):
+    # html.unescape only matters when an entity/char reference is present
+    return html.unescape(s) if s and "&" in s else s
+
+
 def build_global_action_card(old_root, new_root):
     """
     Build a cards-style dict for global action changes with richer semantics.
@@ -3005,100 +3256,102 @@ def build_global_action_card(old_root, new_root):
     if not raw_summary:
         return None
 
-    # For each item from raw_summary (which has xml_old/xml_new), parse deeper details
-    bullets = []
-    for item in raw_summary:
+    # For each item from raw_summary (which has xml_old/xml_new), parse deeper details.
+    # Items are independent, so each one renders its own bullet list.
+    def _process(item):
+        bullets = []
         line = item.get("line", "")
         xml_old = item.get("xml_old")
         xml_new = item.get("xml_new")
+        # encode once; both lxml parses below read the bytes directly
+        buf_old = xml_old.encode("utf-8") if xml_old else None
+        buf_new = xml_new.encode("utf-8") if xml_new else None
 
         # Base bullet headline
         bullets.append(line)
         # ------------------------------------------------------------
         # 🧩 Attach XML snippets for added / removed / modified actions
         # ------------------------------------------------------------
+        xo = xml_old.strip() if xml_old else xml_old
+        xn = xml_new.strip() if xml_new else xml_new
         if xml_old and not xml_new:
             bullets.append("  • [Old XML Snippet] ↓")
-            bullets.append(html.unescape(xml_old.strip()))
+            bullets.append(_maybe_unescape(xo))
         elif xml_new and not xml_old:
             bullets.append("  • [New XML Snippet] ↓")
-            bullets.append(html.unescape(xml_new.strip()))
+            bullets.append(_maybe_unescape(xn))
         elif xml_old and xml_new and xml_old != xml_new:
             bullets.append("  • [Old XML Snippet] ↓")
-            bullets.append(html.unescape(xml_old.strip()))
+            bullets.append(_maybe_unescape(xo))
             bullets.append("  • [New XML Snippet] ↓")
-            bullets.append(html.unescape(xml_new.strip()))
+            bullets.append(_maybe_unescape(xn))
 
 
         # If added — parse new xml for details
         if xml_new and not xml_old:
             try:
-                root_new = ET.fromstring(xml_new)
+                root_new = etree.fromstring(buf_new)
                 details = _parse_action_details(root_new)
+                sources = details.get("sources")
+                targets = details.get("targets")
+                mappings = details.get("field_mappings")
+                behavior = details.get("behavior")
                 # Compose readable lines
-                if details.get("sources"):
-                    for s in details["sources"]:
-                        bullets.append(f"  • Source: {s['kind']} — {s['name']}")
-                if details.get("targets"):
-                    for t in details["targets"]:
-                        bullets.append(f"  • Target: {t['kind']} — {t['name']}")
-                if details.get("field_mappings"):
-                    fm = ", ".join([f"{m['field']} ({m['role']})" for m in details["field_mappings"][:6]])
+                if sources:
+                    bullets.extend(f"  • Source: {kind} — {name}" for kind, name in sources)
+                if targets:
+                    bullets.extend(f"  • Target: {kind} — {name}" for kind, name in targets)
+                if mappings:
+                    fm = ", ".join([f"{field} ({role})" for field, role in mappings[:6]])
                     bullets.append(f"  • Fields involved: {fm}")
-                if details.get("behavior"):
-                    bullets.append(f"  • Behavior: {details['behavior']}")
+                if behavior:
+                    bullets.append(f"  • Behavior: {behavior}")
             except Exception:
                 pass
 
         # If removed — parse old xml
         if xml_old and not xml_new:
             try:
-                root_old = ET.fromstring(xml_old)
+                root_old = etree.fromstring(buf_old)
                 details = _parse_action_details(root_old)
-                if details.get("sources"):
-                    for s in details["sources"]:
-                        bullets.append(f"  • Source (was): {s['kind']} — {s['name']}")
-                if details.get("targets"):
-                    for t in details["targets"]:
-                        bullets.append(f"  • Target (was): {t['kind']} — {t['name']}")
-                if details.get("field_mappings"):
-                    fm = ", ".join([f"{m['field']} ({m['role']})" for m in details["field_mappings"][:6]])
+                sources = details.get("sources")
+                targets = details.get("targets")
+                mappings = details.get("field_mappings")
+                behavior = details.get("behavior")
+                if sources:
+                    bullets.extend(f"  • Source (was): {kind} — {name}" for kind, name in sources)
+                if targets:
+                    bullets.extend(f"  • Target (was): {kind} — {name}" for kind, name in targets)
+                if mappings:
+                    fm = ", ".join([f"{field} ({role})" for field, role in mappings[:6]])
                     bullets.append(f"  • Fields involved (was): {fm}")
-                if details.get("behavior"):
-                    bullets.append(f"  • Behavior (was): {details['behavior']}")
+                if behavior:
+                    bullets.append(f"  • Behavior (was): {behavior}")
             except Exception:
                 pass
 
         # If modified — parse both and show diffs (concise)
         if xml_old and xml_new:
             try:
-                root_old = ET.fromstring(xml_old)
-                root_new = ET.fromstring(xml_new)
+                root_old = etree.fromstring(buf_old)
+                root_new = etree.fromstring(buf_new)
                 d_old = _parse_action_details(root_old)
                 d_new = _parse_action_details(root_new)
 
                 # compare sources/targets
-                old_srcs = {(s['kind'], s['name']) for s in d_old.get("sources", [])}
-                new_srcs = {(s['kind'], s['name']) for s in d_new.get("sources", [])}
-                added_src = new_srcs - old_srcs
-                removed_src = old_srcs - new_srcs
-                for s in added_src:
-                    bullets.append(f"  • Source added: {s[0]} — {s[1]}")
-                for s in removed_src:
-                    bullets.append(f"  • Source removed: {s[0]} — {s[1]}")
-
-                old_tg = {(t['kind'], t['name']) for t in d_old.get("targets", [])}
-                new_tg = {(t['kind'], t['name']) for t in d_new.get("targets", [])}
-                added_tg = new_tg - old_tg
-                removed_tg = old_tg - new_tg
-                for t in added_tg:
-                    bullets.append(f"  • Target added: {t[0]} — {t[1]}")
-                for t in removed_tg:
-                    bullets.append(f"  • Target removed: {t[0]} — {t[1]}")
+                old_srcs = set(d_old.get("sources", ()))
+                new_srcs = set(d_new.get("sources", ()))
+                bullets.extend(f"  • Source added: {k} — {n}" for k, n in new_srcs - old_srcs)
+                bullets.extend(f"  • Source removed: {k} — {n}" for k, n in old_srcs - new_srcs)
+
+                old_tg = set(d_old.get("targets", ()))
+                new_tg = set(d_new.get("targets", ()))
+                bullets.extend(f"  • Target added: {k} — {n}" for k, n in new_tg - old_tg)
+                bullets.extend(f"  • Target removed: {k} — {n}" for k, n in old_tg - new_tg)
 
                 # fields involvement diff (show small sample)
-                old_fields = {m['field'] for m in d_old.get("field_mappings", [])}
-                new_fields = {m['field'] for m in d_new.get("field_mappings", [])}
+                old_fields = {field for field, _ in d_old.get("field_mappings", ())}
+                new_fields = {field for field, _ in d_new.get("field_mappings", ())}
                 added_fields = sorted(new_fields - old_fields)
                 removed_fields = sorted(old_fields - new_fields)
                 if added_fields:
@@ -3113,6 +3366,16 @@ def build_global_action_card(old_root, new_root):
             except Exception:
                 pass
 
+        return bullets
+
+    # lxml parsing releases the GIL; skip the pool when it would cost more than it saves
+    if len(raw_summary) < 8:
+        parts = [_process(item) for item in raw_summary]
+    else:
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+            parts = list(ex.map(_process, raw_summary))
+    bullets = list(chain.from_iterable(parts))
+
     if not bullets:
         return None
 
@@ -3142,86 +3405,91 @@ def collect_workbook_semantics(sections: dict) -> dict:
         "tooltip_fields": set(),
         "dashboard_sheets": set(),
     }
-    # ADD THIS LOOP to the function:
-    for ds_name, ds_xml in sections.get("datasources", {}).items():
-        ds_feats = collect_semantics(ds_xml) 
-        agg["filters"].update(ds_feats["filters"])
-        # This ensures GPT knows about datasource-level filters
-
-    for sec in ("dashboards", "worksheets","datasources"):
-        for nm, xml in sections.get(sec, {}).items():
-            sem = collect_semantics(xml)
-            for k in agg:
-                agg[k].update(sem.get(k, []))
-    # include datasource filters
+    sems = [
+        collect_semantics(xml)
+        for sec in ("dashboards", "worksheets")
+        for xml in sections.get(sec, {}).values()
+    ]
+
+    # datasources: parse once, feed both semantic + filter extraction
+    ds_filters = []
     for xml in sections.get("datasources", {}).values():
-        agg["filters"].update(parse_datasource_filters(xml))
+        root = _parse_fragment(xml)
+        sems.append(collect_semantics(root))
+        ds_filters.append(parse_datasource_filters(root))
+
+    for k, acc in agg.items():
+        acc.update(chain.from_iterable(s.get(k, ()) for s in sems))
+    # include datasource filters
+    agg["filters"].update(chain.from_iterable(ds_filters))
 
 
     return agg
 
+# collect_workbook_semantics results keyed by id(sections). The sections
+# dict is kept next to the result so a recycled id never hits a stale entry.
+_sem_cache = {}
+
+def reset_comparison_caches():
+    """Drop per-comparison semantic memos; call at the start of each run."""
+    _sem_cache.clear()
+    _semantics_memo.clear()
+
+def _sem(sections):
+    k = id(sections)
+    hit = _sem_cache.get(k)
+    if hit is not None and hit[0] is sections:
+        return hit[1]
+    if len(_sem_cache) >= 8:
+        _sem_cache.clear()
+    v = collect_workbook_semantics(sections)
+    _sem_cache[k] = (sections, v)
+    return v
+
 # =========================================================
 # 🔧 FIX: SEMANTIC WORKBOOK DELTA (NEW)
 # =========================================================
 def build_semantic_workbook_delta(old_sections, new_sections):
+    if old_sections is new_sections:
+        return []
+
     bullets = []
 
-    old_sem = collect_workbook_semantics(old_sections)
-    new_sem = collect_workbook_semantics(new_sections)
+    old_sem = _sem(old_sections)
+    new_sem = _sem(new_sections)
 
     # KPI-style semantic changes
-    for k in old_sem:
-        if len(old_sem[k]) != len(new_sem[k]):
+    for k in dict.fromkeys([*old_sem, *new_sem]):
+        lo, ln = len(old_sem.get(k, ())), len(new_sem.get(k, ()))
+        if lo != ln:
             bullets.append(
-                f"📊 {k.replace('_',' ').title()} changed: "
-                f"{len(old_sem[k])} → {len(new_sem[k])}"
+                f"📊 {k.replace('_',' ').title()} changed: {lo} → {ln}"
             )
 
-    def diff_set(label, a, b, add_icon="➕", rem_icon="➖"):
+    # build each compared set once
+    keys = ("filters", "dashboard_filters", "actions", "legends", "colors")
+    O = {k: set(old_sem.get(k, ())) for k in keys}
+    N = {k: set(new_sem.get(k, ())) for k in keys}
+
+    def diff_set(label, k, add_icon="➕", rem_icon="➖"):
         out = []
-        if b - a:
-            out.append(f"{add_icon} {label} added: {', '.join(sorted(b - a))}")
-        if a - b:
-            out.append(f"{rem_icon} {label} removed: {', '.join(sorted(a - b))}")
+        added = N[k].difference(O[k])
+        removed = O[k].difference(N[k])
+        if added:
+            out.append(f"{add_icon} {label} added: {', '.join(sorted(added))}")
+        if removed:
+            out.append(f"{rem_icon} {label} removed: {', '.join(sorted(removed))}")
         return out
 
-    bullets += diff_set(
-        "Worksheet-level filters",
-        set(old_sem.get("filters", [])),
-        set(new_sem.get("filters", [])),
-        "🔎", "🔎"
-    )
-
-    bullets += diff_set(
-        "Dashboard-level filters",
-        set(old_sem.get("dashboard_filters", [])),
-        set(new_sem.get("dashboard_filters", [])),
-        "📊", "📊"
-    )
-
-    bullets += diff_set(
-        "Actions",
-        set(old_sem.get("actions", [])),
-        set(new_sem.get("actions", [])),
-        "⚡", "⚡"
-    )
+    bullets += diff_set("Worksheet-level filters", "filters", "🔎", "🔎")
+    bullets += diff_set("Dashboard-level filters", "dashboard_filters", "📊", "📊")
+    bullets += diff_set("Actions", "actions", "⚡", "⚡")
 
     if old_sem.get("tooltip_fields") != new_sem.get("tooltip_fields"):
         bullets.append("💬 Tooltip content was modified across one or more views.")
 
-    bullets += diff_set(
-        "Legends",
-        set(old_sem.get("legends", [])),
-        set(new_sem.get("legends", [])),
-        "🧭", "🧭"
-    )
-
-    bullets += diff_set(
-        "Color encodings",
-        set(old_sem.get("colors", [])),
-        set(new_sem.get("colors", [])),
-        "🎨", "🎨"
-    )
+    bullets += diff_set("Legends", "legends", "🧭", "🧭")
+    bullets += diff_set("Color encodings", "colors", "🎨", "🎨")
 
     return bullets
 
@@ -3263,34 +3531,27 @@ def build_visual_change_tree(sections):
     # ===============================
     # ⚡ ACTIONS (OPTIONAL)
     # ===============================
-    actions = collect_workbook_semantics(sections).get("actions", [])
+    actions = _sem(sections).get("actions", [])
     for a in actions:
         tree["Workbook"]["⚡ Actions"][a] = {}
 
     return tree
 
 
+_LEVEL_RE = {
+    "workbook": re.compile(r"datasource|parameter|calculation|hierarchy", re.I),
+    "dashboard": re.compile(r"dashboard|action|layout|filter", re.I),
+    "worksheet": re.compile(r"worksheet|filter|tooltip|mark|color", re.I),
+}
+
 def filter_visual_bullets(level, bullets):
     """
     Keep only bullets relevant to the current visual level.
     """
-    out = []
-    for b in bullets:
-        bl = b.lower()
-
-        if level == "workbook":
-            if any(k in bl for k in ("datasource", "parameter", "calculation", "hierarchy")):
-                out.append(b)
-
-        elif level == "dashboard":
-            if any(k in bl for k in ("dashboard", "action", "layout", "filter")):
-                out.append(b)
-
-        elif level == "worksheet":
-            if any(k in bl for k in ("worksheet", "filter", "tooltip", "mark", "color")):
-                out.append(b)
-
-    return out
+    pat = _LEVEL_RE.get(level)
+    if pat is None:
+        return []
+    return [b for b in bullets if pat.search(b)]
 
 
 def split_gpt_bullets(bullets):
@@ -3303,33 +3564,14 @@ def split_gpt_bullets(bullets):
     idx = bullets.index("--- GPT Summary ---")
     return bullets[:idx], bullets[idx+1:]
 
-def svg_expandable_block(x, y, title, status, bullets):
-    bg = {
-        "added": "#E8F5E9",
-        "removed": "#FDECEA",
-        "modified": "#FFF8E1"
-    }.get(status, "#FFF")
-
-    level = (
-    "workbook" if "Workbook" in title
-    else "dashboard" if "Dashboard" in title
-    else "worksheet"
-    )
-
-    clean_bullets = filter_visual_bullets(level, bullets)
-
-    # collapse FIRST
-    if len(clean_bullets) > 1:
-        clean_bullets = [visual_summary_line(clean_bullets)]
-
-    li = "".join(
-        f"<li>{html.escape(simplify_visual_bullet(b))}</li>"
-        for b in clean_bullets
-    )
-
-
+_STATUS_BG = {
+    "added": "#E8F5E9",
+    "removed": "#FDECEA",
+    "modified": "#FFF8E1"
+}
 
-    return f"""
+# {t} title, {s} summary line, {li} bullet items — all pre-escaped
+_EXP_TMPL = """
 <foreignObject x="{x}" y="{y}" width="440" height="320">
   <div xmlns="http://www.w3.org/1999/xhtml"
        style="font:13px Segoe UI;background:{bg};
@@ -3337,9 +3579,9 @@ def svg_expandable_block(x, y, title, status, bullets):
               padding:10px;box-shadow:0 2px 8px rgba(0,0,0,.1)">
     <details>
       <summary style="font-weight:700;cursor:pointer">
-        {html.escape(title)}<br/>
+        {t}<br/>
         <span>
-            {html.escape(visual_summary_line(clean_bullets))}
+            {s}
         </span>
 
       </summary>
@@ -3351,33 +3593,57 @@ def svg_expandable_block(x, y, title, status, bullets):
 </foreignObject>
 """
 
+def svg_expandable_block(x, y, title, status, bullets):
+    bg = _STATUS_BG.get(status, "#FFF")
+
+    level = (
+    "workbook" if "Workbook" in title
+    else "dashboard" if "Dashboard" in title
+    else "worksheet"
+    )
+
+    if not bullets:
+        clean_bullets = []
+    elif len(bullets) == 1:
+        clean_bullets = bullets if _LEVEL_RE[level].search(bullets[0]) else []
+    else:
+        clean_bullets = filter_visual_bullets(level, bullets)
+
+    # collapse FIRST
+    if len(clean_bullets) > 1:
+        clean_bullets = [visual_summary_line(clean_bullets)]
+
+    li = "".join(
+        f"<li>{html.escape(simplify_visual_bullet(b))}</li>"
+        for b in clean_bullets
+    )
+
+    return _EXP_TMPL.format(
+        x=x, y=y, bg=bg, li=li,
+        t=html.escape(title),
+        s=html.escape(visual_summary_line(clean_bullets)),
+    )
+
+_CAT_RE = re.compile(r"filter|calculation|lod|worksheet|datasource", re.I)
+
 def visual_summary_line(bullets):
-    counts = {
-        "filter": 0,
-        "calculation": 0,
-        "worksheet": 0,
-        "datasource": 0,
-    }
+    counts = {"filter": 0, "calculation": 0, "worksheet": 0, "datasource": 0}
     for b in bullets:
-        bl = b.lower()
-        if "filter" in bl:
-            counts["filter"] += 1
-        if "calculation" in bl or "lod" in bl:
-            counts["calculation"] += 1
-        if "worksheet" in bl:
-            counts["worksheet"] += 1
-        if "datasource" in bl:
-            counts["datasource"] += 1
-
-    parts = []
-    if counts["filter"]:
-        parts.append(f"{counts['filter']} filter changes")
-    if counts["calculation"]:
-        parts.append(f"{counts['calculation']} calculation changes")
-    if counts["worksheet"]:
-        parts.append(f"{counts['worksheet']} worksheet changes")
-    if counts["datasource"]:
-        parts.append(f"{counts['datasource']} datasource changes")
+        # each category counts at most once per bullet
+        cats = {m.group(0).lower() for m in _CAT_RE.finditer(b)}
+        if "lod" in cats:
+            cats.discard("lod")
+            cats.add("calculation")
+        for cat in cats:
+            counts[cat] += 1
+
+    pairs = (
+        (counts["filter"], "filter changes"),
+        (counts["calculation"], "calculation changes"),
+        (counts["worksheet"], "worksheet changes"),
+        (counts["datasource"], "datasource changes"),
+    )
+    parts = [f"{n} {lbl}" for n, lbl in pairs if n]
 
     return ", ".join(parts) or "Configuration updated"
 
@@ -3389,23 +3655,22 @@ def collapse_entries(entries):
     if not entries:
         return None
 
-    all_bullets = []
     status = "modified"
 
     # If dict → flatten values
     if isinstance(entries, dict):
-        for v in entries.values():
-            if isinstance(v, list):
-                for e in v:
-                    all_bullets.extend(e.get("bullets", []))
+        src = chain.from_iterable(v for v in entries.values() if isinstance(v, list))
 
     # If list → normal behavior
     elif isinstance(entries, list):
-        for e in entries:
-            if isinstance(e, dict):
-                all_bullets.extend(e.get("bullets", []))
+        src = (e for e in entries if isinstance(e, dict))
 
-    all_bullets = dedupe_visual_bullets(all_bullets)
+    else:
+        src = ()
+
+    all_bullets = dedupe_visual_bullets(
+        chain.from_iterable(e.get("bullets", ()) for e in src)
+    )
 
     if not all_bullets:
         return None
@@ -3416,27 +3681,7 @@ def collapse_entries(entries):
     }
 
 
-def svg_expandable_summary(x, y, card):
-    """
-    Expandable SVG block with deterministic + GPT summary.
-    """
-    status = card["status"]
-    title = f"{card['icon']} {card['title']} — {card['name']}"
-    bullets = card.get("bullets", [])
-
-    sem, gpt = split_gpt_bullets(bullets)
-
-    color_map = {
-        "added": "#E8F5E9",
-        "removed": "#FDECEA",
-        "modified": "#FFF8E1"
-    }
-    bg = color_map.get(status, "#FFFFFF")
-
-    def li(items):
-        return "".join(f"<li>{html.escape(i)}</li>" for i in items)
-
-    return f"""
+_EXP_SUMMARY_TMPL = """
 <foreignObject x="{x}" y="{y}" width="420" height="320">
   <div xmlns="http://www.w3.org/1999/xhtml"
        style="
@@ -3450,20 +3695,53 @@ def svg_expandable_summary(x, y, card):
        ">
     <details>
       <summary style="cursor:pointer;font-weight:700;">
-        {html.escape(title)}
+        {t}
       </summary>
 
       <div style="margin-top:6px; max-height:260px; overflow:auto;">
         <b>🔍 Detected changes</b>
-        <ul>{li(sem)}</ul>
+        <ul>{sem}</ul>
 
-        {"<hr><b>🤖 GPT Summary</b><ul>"+li(gpt)+"</ul>" if gpt else ""}
+        {gpt}
       </div>
     </details>
   </div>
 </foreignObject>
 """
 
+def svg_expandable_summary(x, y, card):
+    """
+    Expandable SVG block with deterministic + GPT summary.
+    """
+    status = card["status"]
+    title = f"{card['icon']} {card['title']} — {card['name']}"
+    bullets = card.get("bullets", [])
+
+    sem, gpt = split_gpt_bullets(bullets)
+
+    bg = _STATUS_BG.get(status, "#FFFFFF")
+
+    def li(items):
+        return "".join(f"<li>{html.escape(i)}</li>" for i in items)
+
+    return _EXP_SUMMARY_TMPL.format(
+        x=x, y=y, bg=bg,
+        t=html.escape(title),
+        sem=li(sem),
+        gpt="<hr><b>🤖 GPT Summary</b><ul>" + li(gpt) + "</ul>" if gpt else "",
+    )
+
+_BOX_TMPL = (
+    '<rect x="{x}" y="{y}" rx="8" ry="8" width="{w}" height="{h}" '
+    'fill="{fill}" stroke="#444"/>'
+    '<text x="{tx}" y="{ty}" font-size="13">{txt}</text>'
+)
+_ARROW_TMPL = (
+    '<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}" '
+    'stroke="#666" stroke-width="1.3" marker-end="url(#arrow)"/>'
+)
+
+
 def render_svg_flow(tree):
     X = {"wb": 30, "dash": 260, "ws": 520, "chg": 820}
     BOX_W = {"wb": 180, "dash": 220, "ws": 220}
@@ -3471,21 +3749,17 @@ def render_svg_flow(tree):
     ROW = 70
 
     elems = []
+    append = elems.append
     y = 40
 
     def box(x, y, w, h, txt, fill):
-        elems.append(f"""
-        <rect x="{x}" y="{y}" rx="8" ry="8" width="{w}" height="{h}"
-              fill="{fill}" stroke="#444"/>
-        <text x="{x+10}" y="{y+25}" font-size="13">{html.escape(txt)}</text>
-        """)
+        append(_BOX_TMPL.format(
+            x=x, y=y, w=w, h=h, fill=fill,
+            tx=x + 10, ty=y + 25, txt=html.escape(txt)
+        ))
 
     def arrow(x1, y1, x2, y2):
-        elems.append(f"""
-        <line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}"
-              stroke="#666" stroke-width="1.3"
-              marker-end="url(#arrow)"/>
-        """)
+        append(_ARROW_TMPL.format(x1=x1, y1=y1, x2=x2, y2=y2))
 
     defs = """
     <defs>
@@ -3502,6 +3776,7 @@ def render_svg_flow(tree):
     y += ROW
 
     dashboards = tree["Workbook"].get("📊 Dashboards", {})
+    ws_reg = CHANGE_REGISTRY.get("worksheets", {})
 
     # ================= Dashboards =================
     for dash_name, dash_node in dashboards.items():
@@ -3515,7 +3790,7 @@ def render_svg_flow(tree):
         # ---- Dashboard Filters summary ----
         collapsed_dash = collapse_entries(dash_node.get("Filters", []))
         if collapsed_dash:
-            elems.append(
+            append(
                 svg_expandable_block(
                     X["chg"], y,
                     f"Dashboard Filters — {dash_name}",
@@ -3536,10 +3811,10 @@ def render_svg_flow(tree):
                   X["ws"], ws_y + BOX_H // 2)
             y += ROW
 
-            ws_entries = CHANGE_REGISTRY.get("worksheets", {}).get(ws, [])
+            ws_entries = ws_reg.get(ws, [])
             collapsed_ws = collapse_entries(ws_entries)
             if collapsed_ws:
-                elems.append(
+                append(
                     svg_expandable_block(
                         X["chg"], y,
                         f"Worksheet Changes — {ws}",
@@ -3552,8 +3827,9 @@ def render_svg_flow(tree):
                 y += 340
 
     # ================= Workbook-level changes =================
-    for e in CHANGE_REGISTRY.get("workbook", []):
-        elems.append(
+    wb_reg = CHANGE_REGISTRY.get("workbook", [])
+    for e in wb_reg:
+        append(
             svg_expandable_block(
                 X["chg"], y,
                 e["title"], e["status"], e["bullets"]
@@ -3572,14 +3848,10 @@ def dedupe_visual_bullets(bullets):
     Remove duplicates and overly similar lines for SVG.
     Keeps first occurrence only.
     """
-    seen = set()
-    clean = []
+    out = {}
     for b in bullets:
-        key = simplify_visual_bullet(b).lower()
-        if key not in seen:
-            seen.add(key)
-            clean.append(b)
-    return clean
+        out.setdefault(simplify_visual_bullet(b).lower(), b)
+    return list(out.values())
 def extract_formula(xml):
     root = _parse_fragment(xml)
     if root is None:
@@ -3591,21 +3863,10 @@ def extract_formula(xml):
 
     return calc.attrib.get("formula") or (calc.text or "").strip()
 
-def is_rls_calculation(formula: str) -> bool:
-    if not formula:
-        return False
-    f = formula.upper()
-    return any(k in f for k in ("USERNAME(", "USERFULLNAME(", "ISMEMBEROF("))
+_RLS_RE = re.compile(r"USERNAME\(|USERFULLNAME\(|ISMEMBEROF\(", re.I)
 
-def is_calc_used_as_filter(calc_name, new_sections):
-    for ws_xml in new_sections.get("worksheets", {}).values():
-        sem = collect_semantics(ws_xml)
-        if (
-            calc_name in sem.get("filters", [])
-            or calc_name in sem.get("dashboard_filters", [])
-        ):
-            return True
-    return False
+def is_rls_calculation(formula: str) -> bool:
+    return bool(formula) and _RLS_RE.search(formula) is not None
 
 def build_formula_index(calcs: dict):
     """
@@ -3624,25 +3885,28 @@ def build_formula_index(calcs: dict):
 
     return index
 
-def detect_rls_renames(old_calcs, new_calcs):
+def detect_rls_renames(old_formulas, new_formulas):
+    """
+    Takes name -> formula maps (see build_cards), not raw calculation XML.
+    """
     renames = {}
 
     old_rls = {
-        name: extract_formula(xml)
-        for name, xml in old_calcs.items()
-        if is_rls_calculation(extract_formula(xml))
+        name: formula
+        for name, formula in old_formulas.items()
+        if is_rls_calculation(formula)
     }
 
-    new_rls = {
-        name: extract_formula(xml)
-        for name, xml in new_calcs.items()
-        if is_rls_calculation(extract_formula(xml))
-    }
+    # formula -> [new calc names]
+    new_by_formula = {}
+    for name, formula in new_formulas.items():
+        if is_rls_calculation(formula):
+            new_by_formula.setdefault(formula, []).append(name)
 
     for o_name, o_formula in old_rls.items():
         matches = [
-            n_name for n_name, n_formula in new_rls.items()
-            if o_formula == n_formula and o_name != n_name
+            n_name for n_name in new_by_formula.get(o_formula, ())
+            if n_name != o_name
         ]
 
         # ✅ ONLY 1-to-1 rename allowed
@@ -3658,6 +3922,17 @@ def detect_rls_renames(old_calcs, new_calcs):
 def build_cards(old_sections, new_sections):
     cards = []
 
+    # collect_semantics per fragment, shared by the modified branch and the
+    # calculation filter check (section strings outlive this call, so id() is stable)
+    sem_by_id = {}
+
+    def sem_of(xml):
+        k = id(xml)
+        sem = sem_by_id.get(k)
+        if sem is None:
+            sem = sem_by_id[k] = collect_semantics(xml)
+        return sem
+
     # ================= NON-CALC SECTIONS =================
     for sec, label in (
         ("dashboards", "Dashboard"),
@@ -3670,6 +3945,11 @@ def build_cards(old_sections, new_sections):
         new = new_sections.get(sec, {})
         all_names = sorted(set(old) | set(new))
 
+        # content hashes: differing hashes prove a change without a full
+        # string compare (equal hashes still fall back to == below)
+        old_hash = {k: hash(v) for k, v in old.items() if v}
+        new_hash = {k: hash(v) for k, v in new.items() if v}
+
         for name in all_names:
             o = old.get(name)
             n = new.get(name)
@@ -3702,13 +3982,13 @@ def build_cards(old_sections, new_sections):
                     "bullets": [f"{label} '{name}' added"]
                 })
 
-            elif o and n and o != n:
+            elif o and n and (old_hash[name] != new_hash[name] or o != n):
                 if label in ("Dashboard", "Story") and is_story_publish_noise(o, n):
                     continue
 
                 ops = xmldiff_text(o, n)
-                sem_old = collect_semantics(o)
-                sem_new = collect_semantics(n)
+                sem_old = sem_of(o)
+                sem_new = sem_of(n)
 
                 bullets = summarize_semantics(label, sem_old, sem_new)
 
@@ -3731,14 +4011,18 @@ def build_cards(old_sections, new_sections):
     old_calcs = old_sections.get("calculations", {})
     new_calcs = new_sections.get("calculations", {})
 
-    rls_renames = detect_rls_renames(old_calcs, new_calcs)
+    # each calculation fragment is parsed once for its formula
+    old_formulas = {name: extract_formula(xml) for name, xml in old_calcs.items()}
+    new_formulas = {name: extract_formula(xml) for name, xml in new_calcs.items()}
+
+    rls_renames = detect_rls_renames(old_formulas, new_formulas)
 
     renamed_old = set(rls_renames.keys())
     renamed_new = set(rls_renames.values())
 
     # 🔁 RENAME CARDS
     for old_name, new_name in rls_renames.items():
-        formula = extract_formula(new_calcs[new_name])
+        formula = new_formulas[new_name]
 
         cards.append({
             "status": "modified",
@@ -3754,11 +4038,11 @@ def build_cards(old_sections, new_sections):
         })
 
     # 🟥 REMOVED CALCULATIONS
-    for name, xml in old_calcs.items():
+    for name in old_calcs:
         if name in renamed_old or name in new_calcs:
             continue
 
-        formula = extract_formula(xml)
+        formula = old_formulas[name]
 
         cards.append({
             "status": "removed",
@@ -3777,18 +4061,26 @@ def build_cards(old_sections, new_sections):
         })
 
     # 🟩 ADDED CALCULATIONS
-    for name, xml in new_calcs.items():
+    # worksheet filter names, gathered once instead of per added calculation
+    filter_names = set()
+    if any(n not in renamed_new and n not in old_calcs for n in new_calcs):
+        for ws_xml in new_sections.get("worksheets", {}).values():
+            s = sem_of(ws_xml)
+            filter_names.update(s.get("filters", ()))
+            filter_names.update(s.get("dashboard_filters", ()))
+
+    for name in new_calcs:
         if name in renamed_new or name in old_calcs:
             continue
 
-        formula = extract_formula(xml)
+        formula = new_formulas[name]
 
         bullets = []
         if is_rls_calculation(formula):
             bullets.append("Type: Row-Level Security")
         if formula:
             bullets.append(f"Formula: {formula}")
-        if is_calc_used_as_filter(name, new_sections):
+        if name in filter_names:
             bullets.append("Applied as worksheet filter (TRUE)")
 
         cards.append({
@@ -3831,6 +4123,18 @@ def render_known_limitations_card() -> str:
     """
 
 
+# section -> (registry level, fixed parent or None for the card name,
+#             title template filled from the card)
+_CARD_TITLE = "{icon} {title} — {name}"
+_SECTION_DISPATCH = {
+    "datasources": ("datasource", None, _CARD_TITLE),
+    "calculations": ("datasource", "Unknown Datasource", "Calculation — {name}"),
+    "worksheets": ("worksheet", None, _CARD_TITLE),
+    "dashboards": ("dashboard", None, _CARD_TITLE),
+    "stories": ("story", None, _CARD_TITLE),
+}
+
+
 def populate_change_registry_from_cards(cards):
     """
     Single source of truth.
@@ -3839,67 +4143,41 @@ def populate_change_registry_from_cards(cards):
 
     for c in cards:
         section = c["section"]
-        title = f"{c['icon']} {c['title']} — {c['name']}"
         status = c["status"]
         bullets = c.get("bullets", [])
 
-        if section == "datasources":
-            register_change(
-                level="datasource",
-                parent=c["name"],
-                title=title,
-                status=status,
-                bullets=bullets
-            )
-
-        elif section == "calculations":
-            parent = "Unknown Datasource"
-            register_change(
-                level="datasource",
-                parent=parent,
-                title=f"Calculation — {c['name']}",
-                status=status,
-                bullets=bullets
-            )
-
-        elif section == "parameters":
+        if section == "parameters":
             CHANGE_REGISTRY["parameters"].setdefault("Parameters", []).append({
                 "status": status,
                 "title": f"Parameter — {c['name']}",
                 "object": c["name"],
                 "bullets": bullets
             })
+            continue
 
-        elif section == "worksheets":
-            register_change(
-                level="worksheet",
-                parent=c["name"],
-                title=title,
-                status=status,
-                bullets=bullets
-            )
+        entry = _SECTION_DISPATCH.get(section)
+        if entry is None:
+            continue
 
-        elif section == "dashboards":
-            register_change(
-                level="dashboard",
-                parent=c["name"],
-                title=title,
-                status=status,
-                bullets=bullets
-            )
+        # 🚫 CRITICAL FIX: ignore publish-only story noise
+        if section == "stories" and not bullets:
+            continue
 
-        elif section == "stories":
-            # 🚫 CRITICAL FIX: ignore publish-only noise
-            if not bullets:
-                continue
+        level, parent, title_tmpl = entry
+        register_change(
+            level=level,
+            parent=parent or c["name"],
+            title=title_tmpl.format_map(c),
+            status=status,
+            bullets=bullets
+        )
+
+_BRACKET_RE = re.compile(r'\[([^\]]+)\]')
+# diff lines mentioning "filter" together with an insert/delete op
+_FILTER_LINE_RE = re.compile(
+    r'^(?=[^\n]*filter)[^\n]*(?:insert|delete)[^\n]*$', re.I | re.M
+)
 
-            register_change(
-                level="story",
-                parent=c["name"],
-                title=title,
-                status=status,
-                bullets=bullets
-            )
 
 def extract_datasource_filter_changes(old_sections, new_sections):
     """
@@ -3924,21 +4202,24 @@ def extract_datasource_filter_changes(old_sections, new_sections):
         added = set()
         removed = set()
 
-        for line in diff.splitlines():
-            if "filter" not in line.lower():
+        for lm in _FILTER_LINE_RE.finditer(diff):
+            line = lm.group(0)
+            low = line.lower()
+            is_insert = "insert" in low
+            is_delete = "delete" in low
+
+            m = _BRACKET_RE.search(line)
+            if not m:
                 continue
+            name = m.group(1)
 
             # added filter
-            if "insert" in line.lower():
-                m = re.search(r'\[([^\]]+)\]', line)
-                if m:
-                    added.add(m.group(1))
+            if is_insert:
+                added.add(name)
 
             # removed filter
-            if "delete" in line.lower():
-                m = re.search(r'\[([^\]]+)\]', line)
-                if m:
-                    removed.add(m.group(1))
+            if is_delete:
+                removed.add(name)
 
         for f in sorted(added):
             facts.append(
@@ -3952,6 +4233,42 @@ def extract_datasource_filter_changes(old_sections, new_sections):
 
     return facts
 
+
+# bullet substrings that mark publish/layout noise in the summary card
+_NOISE_KEYWORDS = [
+    "repository",
+    "content-url",
+    "site",
+    "workbook location",
+    "published to",
+    "url",
+    "uuid",
+    "id",
+    "zone",
+    "layout",
+    "container",
+    "device layout",
+    "floating",
+    "tiled",
+    "resize",
+    "reposition",
+    "no visible change",
+    "no functional change",
+]
+_NOISE_RE = re.compile("|".join(map(re.escape, _NOISE_KEYWORDS)), re.I)
+
+
+def _fmt_facts(items):
+    """
+    One prompt line per fact payload: - [type] name: fact; fact
+    """
+    if not items:
+        return "(none)"
+    return "\n".join(
+        f"- [{i['type']}] {i['name']}: {'; '.join(i['facts'])}" for i in items
+    )
+
+
 def build_overall_workbook_summary_card(
     old_sections,
     new_sections,
@@ -3970,29 +4287,7 @@ def build_overall_workbook_summary_card(
     removed_facts = []
     modified_facts = []
 
-    NOISE_KEYWORDS = [
-        "repository",
-        "content-url",
-        "site",
-        "workbook location",
-        "published to",
-        "url",
-        "uuid",
-        "id",
-        "zone",
-        "layout",
-        "container",
-        "device layout",
-        "floating",
-        "tiled",
-        "resize",
-        "reposition",
-        "no visible change",
-        "no functional change",
-    ]
-
-    def is_noise(text: str) -> bool:
-        return any(k in text.lower() for k in NOISE_KEYWORDS)
+    is_noise = _NOISE_RE.search
 
     for c in cards:
         status = c.get("status")
@@ -4046,10 +4341,15 @@ def build_overall_workbook_summary_card(
         if root is None:
             return actions
 
-        for a in root.findall(".//action"):
+        # signature = (tag, sorted attrs, text) for every node in the action
+        # subtree; hashable and compared without re-serialising the XML
+        for a in root.iter("action"):
             caption = a.attrib.get("caption")
             if caption:
-                actions[caption] = ET.tostring(a, encoding="unicode")
+                actions[caption] = tuple(
+                    (e.tag, tuple(sorted(e.attrib.items())), (e.text or "").strip())
+                    for e in a.iter()
+                )
 
         return actions
 
@@ -4109,13 +4409,13 @@ CRITICAL COUNT RULE:
 
 FACTS:
 ADDED:
-{added_facts}
+{_fmt_facts(added_facts)}
 
 REMOVED:
-{removed_facts}
+{_fmt_facts(removed_facts)}
 
 MODIFIED:
-{modified_facts}
+{_fmt_facts(modified_facts)}
 
 OUTPUT:
 - EXACTLY {total} bullets
@@ -4157,10 +4457,11 @@ def build_layout_only_card():
     if not CHANGE_REGISTRY["layout_only"]:
         return ""
 
-    items = ""
-    for c in CHANGE_REGISTRY["layout_only"]:
-        for b in c["bullets"]:
-            items += f"<li>{html.escape(b)}</li>"
+    items = "".join(
+        f"<li>{html.escape(b)}</li>"
+        for c in CHANGE_REGISTRY["layout_only"]
+        for b in c["bullets"]
+    )
 
     return f"""
     <div class="panel" style="background:#fafafa;">
@@ -4170,35 +4471,32 @@ def build_layout_only_card():
     """
 
 
+# compiled once; applied to fragments from _parse_fragment
+# all filter-bearing nodes in one compiled walk (document order, no duplicates):
+#   1️⃣ filter nodes
+#   2️⃣ filter-group → groupfilter → column  ✅ MOST COMMON
+#   3️⃣ groupfilter, grouped or standalone (some Tableau versions)
+_XP_FILTER_NODES = etree.XPath(
+    ".//filter | .//groupfilter | .//filter-group//groupfilter//column"
+)
+
 def parse_datasource_filters(xml):
     root = _parse_fragment(xml)
     filters = set()
     if root is None:
         return filters
 
-    # 1️⃣ filter nodes
-    for f in root.findall(".//filter"):
-        col = f.attrib.get("column") or f.attrib.get("field") or f.attrib.get("name")
-        if col:
-            filters.add(col.replace("[","").replace("]",""))
-
-    # 2️⃣ filter-group → groupfilter → column  ✅ MOST COMMON
-    for fg in root.findall(".//filter-group"):
-        for gf in fg.findall(".//groupfilter"):
-            col = gf.attrib.get("column")
-            if col:
-                filters.add(col.replace("[","").replace("]",""))
-            for c in gf.findall(".//column"):
-                nm = c.attrib.get("name") or c.attrib.get("column")
-                if nm:
-                    filters.add(nm.replace("[","").replace("]",""))
-
-    # 3️⃣ standalone groupfilter (some Tableau versions)
-    for gf in root.findall(".//groupfilter"):
-        col = gf.attrib.get("column")
+    for el in _XP_FILTER_NODES(root):
+        a = el.attrib
+        tag = el.tag
+        if tag == "filter":
+            col = a.get("column") or a.get("field") or a.get("name")
+        elif tag == "groupfilter":
+            col = a.get("column")
+        else:
+            col = a.get("name") or a.get("column")
         if col:
-            filters.add(col.replace("[","").replace("]",""))
-            
+            filters.add(col.translate(_STRIP_BRACKETS))
 
     return filters
 
@@ -4210,62 +4508,37 @@ def unique_keep_order(items):
     return out
 
 # ----------- HTML (no XML in view cards; full structural) -----------
+_STATUS_BADGE = {
+    "added": "<span class='badge badge-added'>🟩 Added</span>",
+    "removed": "<span class='badge badge-removed'>🟥 Removed</span>",
+    "modified": "<span class='badge badge-modified'>🟨 Modified</span>",
+}
+_DEFAULT_BADGE = "<span class='badge'>•</span>"
+
 def badge(kind):
-    if kind=="added": return "<span class='badge badge-added'>🟩 Added</span>"
-    if kind=="removed": return "<span class='badge badge-removed'>🟥 Removed</span>"
-    if kind=="modified": return "<span class='badge badge-modified'>🟨 Modified</span>"
-    return "<span class='badge'>•</span>"
+    return _STATUS_BADGE.get(kind, _DEFAULT_BADGE)
 
-def render_cards(cards, force_open=True, skip_empty=True):
-    """
-    Renders cards with:
-    - Light blue theme
-    - Optional collapse behavior
-    - Skips empty cards if required
+# same output as html.escape(s, quote=True), as a single translate pass
+_HTML_ESCAPE_TABLE = str.maketrans({
+    "&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#x27;"
+})
 
-    Params:
-    - force_open: True → cards open by default
-    - skip_empty: True → cards with no bullets are not rendered
+def _li_items(bullets):
     """
+    <li> markup for all bullets, one translate pass per bullet.
+    """
+    return "".join(f"<li>{str(b).translate(_HTML_ESCAPE_TABLE)}</li>" for b in bullets)
 
-    blocks = []
-
-    for c in cards:
-        bullets = c.get("bullets", [])
-
-        # 🚫 Skip empty cards (very important for View-Level section)
-        if skip_empty and not bullets:
-            continue
-
-        # -----------------------------------------
-        # Status → CSS class
-        # -----------------------------------------
-        status = c.get("status", "modified")
-        card_class = f"card card-{status}"
-
-        # -----------------------------------------
-        # Open / Closed control
-        # -----------------------------------------
-        open_attr = "open" if force_open else ""
+_CARD_BORDER = {"added": "#4CAF50", "removed": "#E57373", "modified": "#FFCA28"}
 
-        # -----------------------------------------
-        # Bullet rendering
-        # -----------------------------------------
-        li = "".join(
-            f"<li>{html.escape(str(b))}</li>"
-            for b in bullets
-        )
-
-        block = f"""
-<details class="{card_class}" {open_attr}
+_CARD_TMPL = """
+<details class="card card-{status}" {open_attr}
   style="
     background:#F5F9FF;
     border-radius:12px;
     margin:12px 0;
     border-left:6px solid
-      {'#4CAF50' if status=='added' else
-       '#E57373' if status=='removed' else
-       '#FFCA28'};
+      {border};
   "
 >
   <summary style="
@@ -4274,9 +4547,9 @@ def render_cards(cards, force_open=True, skip_empty=True):
     color:#1F6FE5;
     cursor:pointer;
   ">
-    {c.get('icon','')} <strong>{html.escape(c.get('title',''))}</strong>
-    — {html.escape(c.get('name',''))}
-    {badge(status)}
+    {icon} <strong>{title}</strong>
+    — {name}
+    {badge}
   </summary>
 
   <div class="card-body" style="padding:10px 16px;">
@@ -4286,9 +4559,58 @@ def render_cards(cards, force_open=True, skip_empty=True):
   </div>
 </details>
 """
-        blocks.append(block)
 
-    return "\n".join(blocks)
+def render_cards(cards, force_open=True, skip_empty=True):
+    """
+    Joined HTML for iter_render_cards (same params).
+    """
+    return "\n".join(iter_render_cards(cards, force_open, skip_empty))
+
+def iter_render_cards(cards, force_open=True, skip_empty=True):
+    """
+    Yields one HTML block per card, with:
+    - Light blue theme
+    - Optional collapse behavior
+    - Skips empty cards if required
+
+    Params:
+    - force_open: True → cards open by default
+    - skip_empty: True → cards with no bullets are not rendered
+    """
+
+    escape = html.escape
+
+    # Open / Closed control
+    open_attr = "open" if force_open else ""
+
+    for c in cards:
+        bullets = c.get("bullets", [])
+
+        # 🚫 Skip empty cards (very important for View-Level section)
+        if skip_empty and not bullets:
+            continue
+
+        # -----------------------------------------
+        # Status → CSS class / border colour
+        # -----------------------------------------
+        status = c.get("status", "modified")
+
+        # -----------------------------------------
+        # Bullet rendering
+        # -----------------------------------------
+        li = _li_items(bullets)
+
+        block = _CARD_TMPL.format(
+            status=status,
+            open_attr=open_attr,
+            border=_CARD_BORDER.get(status, "#FFCA28"),
+            icon=c.get("icon", ""),
+            title=escape(c.get("title", "")),
+            name=escape(c.get("name", "")),
+            badge=_STATUS_BADGE.get(status, _DEFAULT_BADGE),
+            li=li,
+        )
+        yield block
 
 
 def render_datasource_cards():
@@ -4312,7 +4634,7 @@ def render_datasource_cards():
             }.get(status, "ℹ️")
 
             bullets = c.get("bullets") or []
-            bullets_html = "".join([f"<li>{html.escape(str(b))}</li>" for b in bullets])
+            bullets_html = _li_items(bullets)
             
             # Sub-card (e.g., "Datasource Summary" or "Datasource Filters")
             cards_html.append(f"""
@@ -4354,6 +4676,18 @@ def render_datasource_cards():
     return "\n".join(blocks)
 
 
+_CAP_BITS = {"read": 1, "write": 2}
+
+# [caps mask][role: creator, explorer, other]
+# Read → View; Write depends on Site Role (none for Viewer / restricted roles)
+_CAP_DISPLAY = (
+    ("View", "View", "View"),
+    ("View", "View", "View"),
+    ("Edit & Publish", "Web Edit", "View"),
+    ("View, Edit & Publish", "View, Web Edit", "View"),
+)
+
+@lru_cache(maxsize=256)
 def map_capabilities_for_display(raw_caps: str, site_role: str) -> str:
     """
     Convert Tableau raw permissions into human-readable capabilities
@@ -4362,51 +4696,28 @@ def map_capabilities_for_display(raw_caps: str, site_role: str) -> str:
     if not raw_caps or raw_caps.strip() == "—":
         return "No Access"
 
-    caps = {c.strip().lower() for c in raw_caps.split(",")}
+    mask = 0
+    for c in raw_caps.split(","):
+        mask |= _CAP_BITS.get(c.strip().lower(), 0)
 
-    display = []
+    role = (site_role or "").lower()
+    role_idx = 0 if "creator" in role else 1 if "explorer" in role else 2
 
-    # Read → View
-    if "read" in caps:
-        display.append("View")
-
-    # Write depends on Site Role
-    if "write" in caps:
-        role = (site_role or "").lower()
-
-        if "creator" in role:
-            display.append("Edit & Publish")
-        elif "explorer" in role:
-            display.append("Web Edit")
-        else:
-            # Viewer or restricted role
-            pass
-
-    return ", ".join(display) if display else "View"
+    return _CAP_DISPLAY[mask][role_idx]
 
 def build_effective_permissions(site_users, workbook_perms, project_perms):
-    user_map = {}
-    group_map = {}
-
-    # Combine workbook + project permissions
-    for p in workbook_perms + project_perms:
-        if p["type"] == "User":
-            user_map[p["name"]] = p
-        elif p["type"] == "Group":
-            group_map[p["name"]] = p
+    # Combine workbook + project permissions (only explicit users are looked up)
+    user_map = {
+        p["name"]: p
+        for p in chain(workbook_perms, project_perms)
+        if p["type"] == "User"
+    }
 
     # If ANY project permission exists, treat it as inherited
-    project_inherited = None
-    for p in project_perms:
-        if p["type"] == "Group" and p["capabilities"]:
-            project_inherited = p
-            break
-
-    print("DEBUG — Project Permission Groups:")
-    for p in project_perms:
-        print(p)
-
-
+    project_inherited = next(
+        (p for p in project_perms if p["type"] == "Group" and p["capabilities"]),
+        None
+    )
 
     effective = []
 
@@ -4438,7 +4749,8 @@ def build_effective_permissions(site_users, workbook_perms, project_perms):
 
             continue
 
-        # 2️⃣ Inherited from project permissions
+        # 2️⃣ Inherited from project permissions (map_capabilities_for_display
+        # is lru_cached, so each role is mapped once)
         if project_inherited:
             effective.append({
                 "name": name,
@@ -4465,14 +4777,14 @@ def build_effective_permissions(site_users, workbook_perms, project_perms):
 
 def get_project_permissions(token, site_id, project_id):
     url = f"{TABLEAU_SITE_URL}/api/3.25/sites/{site_id}/projects/{project_id}/permissions"
-    r = requests.get(
+    r = _HTTP.get(
         url,
         headers={"X-Tableau-Auth": token},
         verify=VERIFY_SSL,
         timeout=30
     )
     r.raise_for_status()
-    return ET.fromstring(r.text)
+    return etree.fromstring(r.content)
 
 
 def resolve_effective_permissions(site_users, workbook_permissions):
@@ -4584,17 +4896,19 @@ def merge_site_users_with_permissions(site_users, permission_rows):
     return merged
 
 def build_users_permissions_card(permissions):
-    rows = ""
+    rows_parts = []
 
     for p in permissions:
-        rows += f"""
+        rows_parts.append(f"""
         <tr>
-          <td>{html.escape(p['name'])}</td>
+          <td>{p['name'].translate(_HTML_ESCAPE_TABLE)}</td>
           <td>{p['type']}</td>
           <td><b>{p['permission']}</b></td>
-          <td>{html.escape(p['capabilities']) if p['capabilities'] else "—"}</td>
+          <td>{p['capabilities'].translate(_HTML_ESCAPE_TABLE) if p['capabilities'] else "—"}</td>
         </tr>
-        """
+        """)
+
+    rows = "".join(rows_parts)
 
     return f"""
     <details class="panel" style="
@@ -4642,99 +4956,94 @@ def render_visual_change_tree(sections, registry, workbook_name):
     Tableau-internal accurate Visual Change Tree
     Structure-only (no GPT, no summaries)
     """
+    return "\n".join(iter_visual_change_tree(sections, registry, workbook_name))
 
-    lines = []
-    lines.append("🌳 Visual Change Tree")
-    lines.append(f"📦 Workbook — {workbook_name}")
+def iter_visual_change_tree(sections, registry, workbook_name):
+    """
+    render_visual_change_tree, one text line at a time.
+    The tree is built from `sections` alone; `registry` is kept for
+    call-site compatibility and is not read.
+    """
+    yield "🌳 Visual Change Tree"
+    yield f"📦 Workbook — {workbook_name}"
 
     # ===============================
     # 📄 WORKSHEETS
     # ===============================
-    lines.append("├── 📄 Worksheets")
+    yield "├── 📄 Worksheets"
  
     for ws_name, ws_xml in sections.get("worksheets", {}).items():
-        lines.append(f"│    ├── {ws_name}")
+        yield f"│    ├── {ws_name}"
  
         sem = collect_semantics(ws_xml)
  
         # 1️⃣ Filters Shelf (Worksheet-level)
         if sem.get("filters"):
-            lines.append("│    │    ├── Filters Shelf (Worksheet)")
+            yield "│    │    ├── Filters Shelf (Worksheet)"
             for f in sem["filters"]:
-                lines.append(f"│    │    │    └── {f}")
- 
-        # 4️⃣ Context Filters
-        context_filters = []
-        try:
-            root = ET.fromstring(ws_xml)
-            for f in root.findall(".//filter[@context='true']"):
-                name = f.attrib.get("column") or f.attrib.get("field")
-                if name:
-                    context_filters.append(name.replace("[", "").replace("]", ""))
-        except Exception:
-            pass
+                yield f"│    │    │    └── {f}"
  
+        # 4️⃣ Context Filters (sorted + deduped by collect_semantics)
+        context_filters = sem.get("context_filters", ())
         if context_filters:
-            lines.append("│    │    ├── Context Filters")
-            for f in sorted(set(context_filters)):
-                lines.append(f"│    │    │    └── {f}")
+            yield "│    │    ├── Context Filters"
+            for f in context_filters:
+                yield f"│    │    │    └── {f}"
  
         # 3️⃣ Marks Card Filters
         if sem.get("mark_fields"):
-            lines.append("│    │    ├── Marks Shelf (Worksheet)")
-            for m in sorted(set(sem["mark_fields"])):
-                lines.append(f"│    │    │    └── {m}")
+            yield "│    │    ├── Marks Shelf (Worksheet)"
+            for m in sem["mark_fields"]:
+                yield f"│    │    │    └── {m}"
  
         # 5️⃣ Action Filters (Indirect)
         actions = sem.get("actions", [])
         if actions:
-            lines.append("│    │    ├── Action Filters")
+            yield "│    │    ├── Action Filters"
             for a in actions:
-                lines.append(f"│    │    │    └── {a}")
+                yield f"│    │    │    └── {a}"
     # ----------------------------
     # 📊 DASHBOARDS
     # ----------------------------
-    lines.append("├── 📊 Dashboards")
+    yield "├── 📊 Dashboards"
     for db_name, db_xml in sections.get("dashboards", {}).items():
-        lines.append(f"│    └── {db_name}")
+        yield f"│    └── {db_name}"
+
+        db_sem = collect_semantics(db_xml)
 
         sheets = extract_dashboard_worksheets(db_xml)
         if sheets:
-            lines.append("│         ├── Worksheets")
+            yield "│         ├── Worksheets"
             for s in sorted(sheets):
-                lines.append(f"│         │    └── {s}")
+                yield f"│         │    └── {s}"
 
-        dash_filters = collect_semantics(db_xml).get("dashboard_filters", [])
+        dash_filters = db_sem.get("dashboard_filters", [])
         if dash_filters:
-            lines.append("│         ├── Dashboard Filters")
+            yield "│         ├── Dashboard Filters"
             for f in dash_filters:
-                lines.append(f"│         │    └── {f}")
+                yield f"│         │    └── {f}"
 
-        actions = collect_semantics(db_xml).get("actions", [])
+        actions = db_sem.get("actions", [])
         if actions:
-            lines.append("│         └── Actions")
+            yield "│         └── Actions"
             for a in actions:
-                lines.append(f"│              └── {a}")
+                yield f"│              └── {a}"
 
     # ----------------------------
     # 📖 STORIES (WITH CONTENTS)
     # ----------------------------
     stories = sections.get("stories", {})
     if stories:
-        lines.append("└── 📖 Stories")
+        yield "└── 📖 Stories"
         for story_name, story_xml in stories.items():
-            lines.append(f"     └── {story_name}")
+            yield f"     └── {story_name}"
 
             story_points = extract_story_contents(story_xml)
             if story_points:
-                lines.append("          ├── Story Points")
+                yield "          ├── Story Points"
                 for sp_name, ws in story_points.items():
-                    lines.append(f"          │    └── {sp_name}")
-                    lines.append(f"          │         └── Worksheet: {ws}")
-
-
-
-    return "\n".join(lines)
+                    yield f"          │    └── {sp_name}"
+                    yield f"          │         └── Worksheet: {ws}"
 
 
 
@@ -4785,8 +5094,17 @@ def generate_html_report(
     clean_title_a = title_a.replace("(Latest)", "").strip()
     clean_title_b = title_b.replace("(Latest)", "").strip()
 
+    # header values escaped once up front (the timestamp format is markup-safe)
+    generated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    esc_title_a = clean_title_a.translate(_HTML_ESCAPE_TABLE)
+    esc_title_b = clean_title_b.translate(_HTML_ESCAPE_TABLE)
+    esc_old_publisher = str(old_publisher).translate(_HTML_ESCAPE_TABLE)
+    esc_new_publisher = str(new_publisher).translate(_HTML_ESCAPE_TABLE)
 
-    html_text = f"""<!DOCTYPE html>
+
+    # the document is written piece by piece; card lists stream from
+    # iter_render_cards instead of being joined into one big string
+    head = f"""<!DOCTYPE html>
 <html>
 <head>
 <meta charset="utf-8">
@@ -4866,21 +5184,21 @@ th,td{{padding:8px;border-bottom:1px solid #ddd;text-align:left}}
   ">
 
     <div style="opacity:0.85;">Generated</div>
-    <div>{html.escape(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))}</div>
+    <div>{generated_at}</div>
 
     <div style="opacity:0.85;">Latest Source Workbook</div>
     <div>
-      <b>{html.escape(clean_title_a)}</b>
+      <b>{esc_title_a}</b>
       <span style="opacity:0.85;">
-        → {html.escape(str(old_publisher))}
+        → {esc_old_publisher}
       </span>
     </div>
 
     <div style="opacity:0.85;">Latest Target Workbook</div>
     <div>
-      <b>{html.escape(clean_title_b)}</b>
+      <b>{esc_title_b}</b>
       <span style="opacity:0.85;">
-        → {html.escape(str(new_publisher))}
+        → {esc_new_publisher}
       </span>
     </div>
 
@@ -4907,11 +5225,9 @@ th,td{{padding:8px;border-bottom:1px solid #ddd;text-align:left}}
 <!-- ===================================================== -->
 <!-- 2️⃣ Overall Workbook Differences Summary -->
 <!-- ===================================================== -->
-{render_cards(
-    [c for c in cards if c.get("section") == "workbook"],
-    force_open=True,
-    skip_empty=False
-)}
+"""
+
+    view_open = """
 
 <!-- ===================================================== -->
 <!-- 3️⃣ View-Level Changes -->
@@ -4926,16 +5242,9 @@ th,td{{padding:8px;border-bottom:1px solid #ddd;text-align:left}}
   </summary>
 
   <div style="margin-top:12px;">
-    {render_cards(
-        [
-            c for c in cards
-            if c.get("section") != "workbook"
-            and c.get("section") != "datasource"
-            and c.get("title") != "Overall Workbook Differences Summary"
-        ],
-        force_open=True,
-        skip_empty=True
-    )}
+    """
+
+    view_close = """
   </div>
 </details>
 
@@ -4982,7 +5291,9 @@ th,td{{padding:8px;border-bottom:1px solid #ddd;text-align:left}}
       overflow:auto;
       margin:0;
     ">
-{html.escape(visual_tree_text)}
+"""
+
+    tree_close = """
     </pre>
   </div>
 </details>
@@ -4992,7 +5303,9 @@ th,td{{padding:8px;border-bottom:1px solid #ddd;text-align:left}}
 <!-- ===================================================== -->
 <!-- Datasource Changes -->
 <!-- ===================================================== -->
-{render_datasource_cards()}
+"""
+
+    tail = """
 
 <!-- ===================================================== -->
 <!-- 5️⃣ Known Limitations -->
@@ -5021,8 +5334,41 @@ th,td{{padding:8px;border-bottom:1px solid #ddd;text-align:left}}
 </div>
 """
 
-    with open(out_file, "w", encoding="utf-8") as f:
-        f.write(html_text)
+    # written to a temp file and swapped in, so a crash never leaves half a report
+    tmp_file = out_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8", buffering=1 << 20) as f:
+        f.write(head)
+        f.writelines(iter_render_cards(
+            [c for c in cards if c.get("section") == "workbook"],
+            force_open=True,
+            skip_empty=False
+        ))
+        f.write(view_open)
+        f.writelines(iter_render_cards(
+            [
+                c for c in cards
+                if c.get("section") != "workbook"
+                and c.get("section") != "datasource"
+                and c.get("title") != "Overall Workbook Differences Summary"
+            ],
+            force_open=True,
+            skip_empty=True
+        ))
+        f.write(view_close)
+        # visual_tree_text may be a str or an iterable of lines (written as produced)
+        if isinstance(visual_tree_text, str):
+            f.write(html.escape(visual_tree_text))
+        else:
+            first = True
+            for line in visual_tree_text:
+                if not first:
+                    f.write("\n")
+                f.write(html.escape(line))
+                first = False
+        f.write(tree_close)
+        f.write(render_datasource_cards())
+        f.write(tail)
+    os.replace(tmp_file, out_file)
 
     try:
         webbrowser.open(f"file:///{os.path.abspath(out_file)}")
@@ -5038,12 +5384,46 @@ th,td{{padding:8px;border-bottom:1px solid #ddd;text-align:left}}
 # ----------- TXT export (optional) -----------
 def write_text(path: str, content: str):
     pathlib.Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8", buffering=1 << 20) as f:
         f.write(content or "")
+    os.replace(tmp_path, path)
     print("📝 Wrote:", os.path.abspath(path))
 
+def write_lines(path: str, lines, compresslevel=None):
+    """write_text for an iterable of lines, written as they are produced.
+
+    With compresslevel set the file is gzip-compressed on the fly."""
+    pathlib.Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
+    tmp_path = path + ".tmp"
+    if compresslevel is None:
+        fh = open(tmp_path, "w", encoding="utf-8", buffering=1 << 20)
+    else:
+        fh = gzip.open(tmp_path, "wt", compresslevel=compresslevel, encoding="utf-8")
+    with fh as f:
+        first = True
+        for line in lines:
+            if not first:
+                f.write("\n")
+            f.write(line)
+            first = False
+    os.replace(tmp_path, path)
+    print("📝 Wrote:", os.path.abspath(path))
+
+_SANITIZE_RE = re.compile(r"[^A-Za-z0-9._-]+")
+
+_PERM_ERROR_TMPL = """
+        <div class="panel">
+        <h2>👥 Users & Permissions</h2>
+        <p style="color:#b71c1c;">
+            Unable to retrieve user permissions.<br>
+            Reason: {reason}
+        </p>
+        </div>
+        """
+
 def sanitize_name(s: str) -> str:
-    return re.sub(r"[^A-Za-z0-9._-]+", "_", s.strip())[:200] or "item"
+    return _SANITIZE_RE.sub("_", s.strip())[:200] or "item"
 
 
 def ensure_change_registry_keys():
@@ -5060,6 +5440,8 @@ def main():
     print("Tableau Workbook Comparator (Project → Project)")
     print("==============================================")
 
+    reset_comparison_caches()
+
     token, site_id = sign_in()
     if not token or not site_id:
         print("❌ Tableau login failed")
@@ -5074,16 +5456,25 @@ def main():
     target_project = input("Enter TARGET project name: ").strip()
     target_workbook = input("Enter TARGET workbook name: ").strip()
 
+    # file-name prefix shared by every artifact written below
+    safe_wb = sanitize_name(f"{source_workbook}_VS_{target_workbook}")
+
     # =====================================================
     # FIND WORKBOOK IDS
     # =====================================================
+    # REST calls are I/O-bound, so each source/target pair runs on two threads
     try:
-        source_wid, source_project_id = get_workbook_id_in_project(
-            token, site_id, source_project, source_workbook
-        )
-        target_wid, target_project_id = get_workbook_id_in_project(
-            token, site_id, target_project, target_workbook
-        )
+        with ThreadPoolExecutor(max_workers=2) as ex:
+            fut_src = ex.submit(
+                get_workbook_id_in_project,
+                token, site_id, source_project, source_workbook
+            )
+            fut_tgt = ex.submit(
+                get_workbook_id_in_project,
+                token, site_id, target_project, target_workbook
+            )
+            source_wid, source_project_id = fut_src.result()
+            target_wid, target_project_id = fut_tgt.result()
     except Exception as e:
         print(f"❌ {e}")
         return
@@ -5094,8 +5485,13 @@ def main():
     # =====================================================
     # GET REVISIONS
     # =====================================================
-    source_revs = get_revisions(token, site_id, source_wid)
-    target_revs = get_revisions(token, site_id, target_wid)
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        fut_src_revs = ex.submit(get_revisions, token, site_id, source_wid)
+        fut_tgt_revs = ex.submit(get_revisions, token, site_id, target_wid)
+        fut_src_owner = ex.submit(get_workbook_owner, token, site_id, source_wid)
+        fut_tgt_owner = ex.submit(get_workbook_owner, token, site_id, target_wid)
+        source_revs = fut_src_revs.result()
+        target_revs = fut_tgt_revs.result()
 
     if not source_revs or not target_revs:
         print("❌ Unable to fetch revisions for one or both workbooks")
@@ -5104,8 +5500,8 @@ def main():
     # =====================================================
     # LATEST REVISION (SAFE)
     # =====================================================
-    source_owner = get_workbook_owner(token, site_id, source_wid)
-    target_owner = get_workbook_owner(token, site_id, target_wid)
+    source_owner = fut_src_owner.result()
+    target_owner = fut_tgt_owner.result()
 
     source_latest = get_latest_revision_info(source_revs, source_owner)
     target_latest = get_latest_revision_info(target_revs, target_owner)
@@ -5126,17 +5522,25 @@ def main():
     # =====================================================
     # DOWNLOAD LATEST REVISIONS
     # =====================================================
-    twb_old = download_rev(token, site_id, source_wid, OLD_REV, force=False)
-    twb_new = download_rev(token, site_id, target_wid, NEW_REV, force=False)
-
-    with open(twb_old, "r", encoding="utf-8", errors="ignore") as f:
-        raw_old_twb = f.read()
-
-    with open(twb_new, "r", encoding="utf-8", errors="ignore") as f:
-        raw_new_twb = f.read()
+    if (source_wid, OLD_REV) == (target_wid, NEW_REV):
+        # same cache file — never write it from two threads
+        twb_old = twb_new = download_rev(token, site_id, source_wid, OLD_REV, force=False)
+    else:
+        with ThreadPoolExecutor(max_workers=2) as ex:
+            fut_old = ex.submit(download_rev, token, site_id, source_wid, OLD_REV, force=False)
+            fut_new = ex.submit(download_rev, token, site_id, target_wid, NEW_REV, force=False)
+            twb_old = fut_old.result()
+            twb_new = fut_new.result()
+
+    # each file is read once; the bytes go straight to the parser
+    raw_old_twb = pathlib.Path(twb_old).read_bytes()
+    raw_new_twb = (
+        raw_old_twb if twb_new == twb_old
+        else pathlib.Path(twb_new).read_bytes()
+    )
 
-    root_old = parse_twb(twb_old)
-    root_new = parse_twb(twb_new)
+    root_old = parse_twb(raw_old_twb)
+    root_new = parse_twb(raw_new_twb)
 
     if root_old is None or root_new is None:
         print("❌ Failed to parse one or both TWB files.")
@@ -5171,48 +5575,37 @@ def main():
     # 👥 USERS & PERMISSIONS (SOURCE vs TARGET WORKBOOK)
     # =====================================================
     try:
-        source_permissions = get_users_and_permissions_for_workbook(
-            token,
-            site_id,
-            source_project,
-            source_workbook
-        )
+        # independent REST round trips → fetch source and target together;
+        # each card is rendered on its fetch thread as soon as it returns
+        def _permissions_card(project, workbook, context):
+            return build_users_permissions_card_with_context(
+                project,
+                workbook,
+                get_users_and_permissions_for_workbook(
+                    token, site_id, project, workbook
+                ),
+                context=context
+            )
 
-        target_permissions = get_users_and_permissions_for_workbook(
-            token,
-            site_id,
-            target_project,
-            target_workbook
-        )
+        with ThreadPoolExecutor(max_workers=2) as ex:
+            s_fut = ex.submit(
+                _permissions_card, source_project, source_workbook, "source"
+            )
+            t_fut = ex.submit(
+                _permissions_card, target_project, target_workbook, "Target"
+            )
 
-        # If you don’t have a diff UI yet, stack both cards
-        users_permissions_html = (
-    build_users_permissions_card_with_context(
-        source_project,
-        source_workbook,
-        source_permissions,
-        context="source"
-    )
-    + "<hr/>"
-    + build_users_permissions_card_with_context(
-        target_project,
-        target_workbook,
-        target_permissions,
-        context="Target"
-    )
-)
+            # If you don’t have a diff UI yet, stack both cards
+            users_permissions_html = "<hr/>".join((
+                s_fut.result(),
+                t_fut.result(),
+            ))
 
 
     except Exception as e:
-        users_permissions_html = f"""
-        <div class="panel">
-        <h2>👥 Users & Permissions</h2>
-        <p style="color:#b71c1c;">
-            Unable to retrieve user permissions.<br>
-            Reason: {html.escape(str(e))}
-        </p>
-        </div>
-        """
+        users_permissions_html = _PERM_ERROR_TMPL.format(
+            reason=str(e).translate(_HTML_ESCAPE_TABLE)
+        )
 
     # =====================================================
     # GLOBAL ACTIONS
@@ -5221,36 +5614,56 @@ def main():
     if global_action_card:
         cards.insert(0, global_action_card)
 
+    # last consumer of the source tree; sec_old holds everything still needed
+    root_old = None
+
      # 🔐 SAFETY: ensure all registry buckets exist
     ensure_change_registry_keys()
     # =====================================================
 # DATASOURCES (AUTHORITATIVE – SINGLE FILE)
 # =====================================================
 
-    old_datasources = extract_datasources_raw(twb_old)
-    new_datasources = extract_datasources_raw(twb_new)
+    # reuse the TWB bytes read above, through the same decoder that
+    # extract_datasources_raw (the Streamlit path) uses
+    old_datasources = extract_datasources_from_text(decode_twb_bytes(raw_old_twb))
+    new_datasources = (
+        old_datasources if raw_new_twb is raw_old_twb
+        else extract_datasources_from_text(decode_twb_bytes(raw_new_twb))
+    )
 
-    for ds_name in set(old_datasources) | set(new_datasources):
-        compare(
-            ds_name,
-            old_datasources.get(ds_name),
-            new_datasources.get(ds_name),
-            site_id,
-            token
-        )
+    # union of the key views; the sort only fixes the order once the
+    # registry is seeded below (the pool itself finishes in any order)
+    ds_names = sorted(old_datasources.keys() | new_datasources.keys())
+
+    # the pool below writes the registry in completion order; seeding the
+    # buckets here keeps render_datasource_cards in name order
+    for ds_name in ds_names:
+        CHANGE_REGISTRY["datasources"].setdefault(ds_name, [])
+
+    # compare() may hydrate published datasources over REST, so the
+    # per-datasource calls overlap on a thread pool
+    with ThreadPoolExecutor(max_workers=8) as ex:
+        list(ex.map(
+            lambda ds_name: compare(
+                ds_name,
+                old_datasources.get(ds_name),
+                new_datasources.get(ds_name),
+                site_id,
+                token
+            ),
+            ds_names
+        ))
 
 
     # =====================================================
     # STRUCTURAL XML DIFF
     # =====================================================
-    structural = xmldiff_text(
-        ET.tostring(root_old, encoding="unicode"),
-        ET.tostring(root_new, encoding="unicode")
-    )
+    # diff the downloaded bytes directly and stream the edits to disk
+    struct_path = f"{safe_wb}_LATEST_STRUCT.txt.gz"
+    write_lines(struct_path, iter_xmldiff_bytes(raw_old_twb, raw_new_twb), compresslevel=1)
 
-    safe_wb = sanitize_name(f"{source_workbook}_VS_{target_workbook}")
-    struct_path = f"{safe_wb}_LATEST_STRUCT.txt"
-    write_text(struct_path, structural)
+    # raw TWB bytes are not needed past this point
+    raw_old_twb = raw_new_twb = None
 
     # =====================================================
     # KPIs + VISUAL TREE
@@ -5259,7 +5672,8 @@ def main():
     kpi_new = build_workbook_kpi_snapshot(sec_new)
     kpi_html = render_workbook_kpi_table(kpi_old, kpi_new)
 
-    visual_tree_text = render_visual_change_tree(
+    # lazy: lines are produced while the report is being written
+    visual_tree_text = iter_visual_change_tree(
         sec_new, CHANGE_REGISTRY, target_workbook
     )
 
@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+for _mod in ("lxml", "xmldiff", "openai", "requests", "httpx"):
+    pytest.importorskip(_mod)
+
+# the module builds its OpenAI client at import time
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import tableau_comparator as tc  # noqa: E402
+
+
+_WORKBOOK = """<workbook xmlns:user="http://www.tableausoftware.com/xml/user" version="18.1">
+  <datasources>
+    <datasource name="DS" caption="Sales"><column name="[A]" datatype="string"/></datasource>
+  </datasources>
+  <worksheets>
+    <worksheet name="Overview">
+      <table><view><filter column="[A]" class="categorical"/>{filter}</view></table>
+    </worksheet>
+    <worksheet name="Detail"><table><view/></table></worksheet>
+  </worksheets>
+  <dashboards>
+    <dashboard name="Main"><zones><zone name="Overview"/></zones></dashboard>
+  </dashboards>
+  <windows><window class="worksheet" name="Overview"/></windows>
+</workbook>"""
+
+
+def test_per_unit_diff_matches_full_document_diff():
+    old = _WORKBOOK.format(filter="").encode("utf-8")
+    new = _WORKBOOK.format(
+        filter='<filter column="[B]" class="quantitative"/>'
+    ).encode("utf-8")
+
+    streamed = "\n".join(tc.iter_xmldiff_bytes(old, new))
+
+    assert streamed
+    assert "namespace" not in streamed
+    assert streamed == tc.xmldiff_text(old, new)
+
+
+def test_recovered_fragment_with_undefined_entity_extracts_sections():
+    root = tc._parse_fragment(
+        '<worksheet name="W"><filter column="[A]">&nbsp;</filter>'
+    )
+
+    assert all(isinstance(e.tag, str) for e in root.iter())
+    sections = tc.extract_sections(root)
+    assert "W" in sections["worksheets"]